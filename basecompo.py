@@ -5,46 +5,136 @@ import sys
 import os
 import re
 import fastatools
+import compotools
 import argparse
+import collections
+import multiprocessing
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--outdir', type=str, default=os.getcwd(), help="specify output directory")
 parser.add_argument('--winsize', type=int, default=50, help="specify sliding window size")
+parser.add_argument('--step', type=int, default=None, help="specify sliding window step (default: window size, i.e., non-overlapping windows)")
+parser.add_argument('--mmap', action='store_true', help="memory-map the input files instead of reading whole sequences into memory (memory use independent of the sequence length, needs a regular line length)")
+parser.add_argument('--format', type=str, default='csv', choices=['csv', 'parquet'], help="output format: one CSV file per header (default) or a single Parquet file with all windows")
+parser.add_argument('--output', type=str, default=None, help="Parquet output file (default: basecompo.parquet in the output directory)")
+parser.add_argument('--jobs', type=int, default=1, help="number of worker processes (records are distributed over the workers; implies --mmap)")
 parser.add_argument('infile', type=str, nargs='+', help="specify input file")
 args = parser.parse_args()
 
 outdir = args.outdir
 infiles = args.infile
 
+# column names in the output
+COLUMNS = [ 'percG', 'percC', 'percA', 'percT' ]
+
 def main():
 	make_dir(outdir)
-	for inf in infiles:
-		print("parsing " + inf)
-		parse_fasta(inf)
+	writer = None
+	if args.format == 'parquet':
+		writer = compotools.WindowWriter(args.output if args.output else os.path.join(outdir, 'basecompo.parquet'), COLUMNS)
+	if args.jobs > 1:
+		parse_parallel(infiles, args.jobs, writer)
+	else:
+		for inf in infiles:
+			print("parsing " + inf)
+			parse_fasta(inf, writer)
+	if writer is not None:
+		writer.close()
 
-def parse_fasta(f):
-	db = fastatools.FastaFile(f)
+def parse_fasta(f, writer=None):
+	db = fastatools.FastaFile(f, mmap=args.mmap)
 	for hdr, seq in db.next_seq():
-		gc_content = determine_gc(seq)
-		if gc_content:
+		write_windows(hdr, determine_gc(seq), writer)
+
+def write_windows(hdr, chunks, writer=None):
+	"""
+	Write the windows of one sequence, chunk by chunk as they are counted,
+	to the shared Parquet writer, if there is one, otherwise to
+	<outdir>/<header>.csv
+	"""
+	if writer is not None:
+		for starts, counts in chunks:
+			writer.write(hdr, starts, counts / args.winsize)
+		return
+	of = None
+	for starts, counts in chunks:
+		if of is None:
 			of = open(os.path.join(outdir, hdr + '.csv'), 'w')
-			of.write('pos,percG,percC,percA,percT\n')
-			for l in gc_content:
-				of.write(','.join(str(x) for x in l) + '\n')
-			of.close()
-		else: pass
-
-def determine_gc(seq):
-	gcs = [ ]
-	winsize = args.winsize
-	for i in range(0, len(seq)-winsize, winsize):
-		subs = seq[i:i+winsize]
-		Gs = subs.count('G')
-		Cs = subs.count('C')
-		As = subs.count('A')
-		Ts = subs.count('T')
-		gcs.append([i+1, Gs/winsize, Cs/winsize, As/winsize, Ts/winsize])
-	return(gcs)
+			of.write('pos,' + ','.join(COLUMNS) + '\n')
+		of.writelines(compotools.csv_lines(starts, counts, args.winsize))
+	if of is not None:
+		of.close()
+
+def parse_parallel(files, jobs, writer=None):
+	"""
+	Distribute the records of all input files over a process pool. The work
+	units are just (file name, record name) pairs; each worker reads its
+	records from the memory-mapped file through the Fasta index. CSV files
+	are written by the workers. For Parquet output, the units are chunks of
+	windows instead (file name, record name, first and last window), which
+	are written here in input order.
+	"""
+	units = [ ]
+	for f in files:
+		# build the .fai once here so the workers only have to load it
+		index = fastatools.FastaIndex(f)
+		for name in index:
+			if writer is None:
+				units.append((f, name, 0, None))
+				continue
+			n = compotools.window_count(index.entries[name].length, args.winsize, args.step)
+			units.extend((f, name, k, min(k + compotools.CHUNK, n)) for k in range(0, n, compotools.CHUNK))
+		index.close()
+	pool = multiprocessing.Pool(jobs)
+	try:
+		if writer is None:
+			# imap keeps the input order, so the output is deterministic
+			results = pool.imap(process_record, units, max(1, min(64, len(units) // (jobs * 4))))
+		else:
+			# chunks are big, only a few of them are kept waiting
+			results = imap_bounded(pool, process_record, units, 2 * jobs)
+		current = None
+		for f, hdr, chunk in results:
+			if f != current:
+				print("parsing " + f)
+				current = f
+			if chunk is not None:
+				write_windows(hdr, [ chunk ], writer)
+	finally:
+		pool.close()
+		pool.join()
+
+def imap_bounded(pool, func, units, ahead):
+	"""
+	Like pool.imap(), but with at most `ahead` units submitted whose results
+	have not been collected yet, so the results do not pile up in memory
+	when they are written more slowly than they are computed.
+	"""
+	pending = collections.deque()
+	for unit in units:
+		pending.append(pool.apply_async(func, (unit, )))
+		if len(pending) >= ahead:
+			yield pending.popleft().get()
+	while pending:
+		yield pending.popleft().get()
+
+# memory-mapped input files, opened once per worker process
+open_files = { }
+
+def process_record(unit):
+	f, name, first, last = unit
+	if f not in open_files:
+		open_files[f] = fastatools.FastaFile(f, mmap=True)
+	hdr, seq = open_files[f].view(name)
+	if args.format == 'csv':
+		write_windows(hdr, determine_gc(seq))
+		return f, hdr, None
+	# a single chunk
+	return f, hdr, next(determine_gc(seq, first, last))
+
+def determine_gc(seq, first=0, last=None):
+	# window start positions and G, C, A, T counts per window, chunk by chunk
+	return(compotools.composition(seq, args.winsize, args.step, first, last))
 
 def make_dir(dir):
 	if os.access(dir, os.F_OK):
@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+
+"""
+Compare the pure-Python sliding-window base composition loop (as basecompo.py
+used to do it) with the NumPy kernel in compotools on a random sequence, and
+check that both produce the same CSV text. Times are given for counting
+alone and for counting plus CSV formatting.
+
+Usage: benchmark-basecompo.py [--length 50000000] [--winsize 50] [--step N]
+"""
+
+from __future__ import division
+import sys
+import time
+import random
+import argparse
+import compotools
+
+argparser = argparse.ArgumentParser()
+argparser.add_argument("--length",  type = int, default = 50000000, help = "Sequence length (default: 50000000)")
+argparser.add_argument("--winsize", type = int, default = 50, help = "Window size (default: 50)")
+argparser.add_argument("--step",    type = int, default = None, help = "Window step (default: window size)")
+argparser.add_argument("--seed",    type = int, default = 42)
+
+def python_count(seq, winsize, step):
+	gcs = [ ]
+	for i in range(0, len(seq)-winsize, step):
+		subs = seq[i:i+winsize]
+		Gs = subs.count('G')
+		Cs = subs.count('C')
+		As = subs.count('A')
+		Ts = subs.count('T')
+		gcs.append([i+1, Gs/winsize, Cs/winsize, As/winsize, Ts/winsize])
+	return(gcs)
+
+def python_csv(gcs):
+	return "".join(','.join(str(x) for x in l) + '\n' for l in gcs)
+
+def numpy_count(seq, winsize, step):
+	return list(compotools.composition(seq, winsize, step))
+
+def numpy_csv(chunks, winsize):
+	return "".join(text for starts, counts in chunks for text in compotools.csv_lines(starts, counts, winsize))
+
+def timed(f, *args):
+	t0 = time.perf_counter()
+	res = f(*args)
+	return res, time.perf_counter() - t0
+
+def main(args):
+	random.seed(args.seed)
+	step = args.step if args.step else args.winsize
+	# repeat a random 1 Mb chunk, generating 50 Mb base by base takes too long
+	unit = "".join(random.choice("ACGTN") for i in range(1000003))
+	seq = (unit * (args.length // len(unit) + 1))[:args.length]
+
+	py_res, py_count = timed(python_count, seq, args.winsize, step)
+	py_text, py_csv = timed(python_csv, py_res)
+	np_res, np_count = timed(numpy_count, seq, args.winsize, step)
+	np_text, np_csv = timed(numpy_csv, np_res, args.winsize)
+	if py_text != np_text:
+		sys.exit("Fatal: CSV output differs")
+
+	print("stage\tpython\tnumpy\tspeedup")
+	print("count\t%.2f\t%.2f\t%.1fx" % (py_count, np_count, py_count / np_count))
+	print("count+csv\t%.2f\t%.2f\t%.1fx" % (py_count + py_csv, np_count + np_csv, (py_count + py_csv) / (np_count + np_csv)))
+
+if __name__ == '__main__':
+	main(argparser.parse_args())
@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+
+"""
+Compare the line-based and the block-based Fasta parsers in fastatools on
+synthetic genomes. The genomes are written to a temporary directory (or
+--tmpdir) and removed afterwards.
+
+Usage: benchmark-fasta-parsing.py [--sizes 10M 1G 10G] [--tmpdir DIR]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import fastatools
+
+argparser = argparse.ArgumentParser()
+argparser.add_argument("--sizes",     nargs = '+', default = [ "10M", "1G", "10G" ], help = "Genome sizes in bases, with optional K/M/G suffix (default: 10M 1G 10G)")
+argparser.add_argument("--scaffold",  type = str, default = "10M", help = "Scaffold length (default: 10M)")
+argparser.add_argument("--linewidth", type = int, default = 60, help = "Fasta line width (default: 60)")
+argparser.add_argument("--tmpdir",    type = str, default = None, help = "Directory for the synthetic genomes")
+argparser.add_argument("--seed",      type = int, default = 42)
+
+SUFFIXES = { "K": 10**3, "M": 10**6, "G": 10**9 }
+
+def parse_size(s):
+	s = s.upper()
+	if s[-1] in SUFFIXES:
+		return int(float(s[:-1]) * SUFFIXES[s[-1]])
+	return int(s)
+
+def write_genome(path, size, scaffold_len, linewidth):
+	"""
+	Write a random genome of `size` bases, split into scaffolds. Random lines
+	are drawn from a pool so that generating 10 Gb does not take forever.
+	"""
+	pool = [ "".join(random.choice("ACGT") for i in range(linewidth)) + "\n" for j in range(1024) ]
+	written = 0
+	n = 0
+	with open(path, "w") as fh:
+		while written < size:
+			n += 1
+			length = min(scaffold_len, size - written)
+			fh.write(">scaffold_%d length=%d\n" % (n, length))
+			full, rest = divmod(length, linewidth)
+			for i in range(full):
+				fh.write(pool[i % 1024])
+			if rest:
+				fh.write(pool[full % 1024][:rest] + "\n")
+			written += length
+
+def time_lines(path):
+	bases = 0
+	with open(path) as fh:
+		for hdr, seq in fastatools.parse_lines(fh):
+			bases += len(seq)
+	return bases
+
+def time_blocks(path):
+	bases = 0
+	with open(path, "rb") as fh:
+		for hdr, seq in fastatools.parse_bytes(fh):
+			bases += len(seq)
+	return bases
+
+def main(args):
+	random.seed(args.seed)
+	tmpdir = tempfile.mkdtemp(dir = args.tmpdir)
+	print("size\tengine\tseconds\tMB/s")
+	try:
+		for s in args.sizes:
+			size = parse_size(s)
+			path = os.path.join(tmpdir, "genome_%s.fa" % s)
+			write_genome(path, size, parse_size(args.scaffold), args.linewidth)
+			mb = os.path.getsize(path) / 1e6
+			for name, engine in (("lines", time_lines), ("blocks", time_blocks)):
+				t0 = time.perf_counter()
+				bases = engine(path)
+				elapsed = time.perf_counter() - t0
+				if bases != size:
+					sys.exit("Fatal: %s engine returned %d bases, expected %d" % (name, bases, size))
+				print("%s\t%s\t%.2f\t%.1f" % (s, name, elapsed, mb / elapsed))
+				sys.stdout.flush()
+			os.remove(path)
+	finally:
+		for f in os.listdir(tmpdir):
+			os.remove(os.path.join(tmpdir, f))
+		os.rmdir(tmpdir)
+
+if __name__ == '__main__':
+	main(argparser.parse_args())
@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+
+"""
+Compare the end-to-end throughput of fastq-sample.py with the compression
+backends of gziptools.py. A synthetic FASTQ file is written as plain gzip,
+as BGZF and (if zstd is installed) as zstd, and fastq-sample.py is run on
+each input with each backend that can read it. Throughput is given in MB of
+uncompressed FASTQ per second of wall-clock time. The pigz and zstd backends
+are skipped if the programs are not installed.
+
+Usage: benchmark-fastq-sample.py [--reads 2000000] [--percent 0.01,0.5] [--threads N] [--tmpdir DIR]
+"""
+
+import os
+import sys
+import time
+import gzip
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+import gziptools
+
+argparser = argparse.ArgumentParser()
+argparser.add_argument("--reads",   type = int, default = 2000000, help = "Number of reads in the synthetic FASTQ file (default: 2000000)")
+argparser.add_argument("--length",  type = int, default = 150, help = "Read length (default: 150)")
+argparser.add_argument("--percent", type = str, default = "0.01,0.5", help = "Comma-separated sampling fractions to test (default: 0.01,0.5)")
+argparser.add_argument("--threads", type = int, default = None, help = "Threads for the parallel backends (default: number of CPUs)")
+argparser.add_argument("--tmpdir",  type = str, default = None, help = "Directory for the test files")
+argparser.add_argument("--seed",    type = int, default = 42)
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fastq-sample.py")
+
+def write_fastq(fh, n_reads, length):
+    """
+    Write reads drawn from a pool of random sequences and quality strings,
+    in blocks of 10000 reads.
+    """
+    seqs  = [ "".join(random.choice("ACGT") for i in range(length)) for j in range(5000) ]
+    quals = [ "".join(random.choice("FFFF:,") for i in range(length)) for j in range(500) ]
+    for start in range(0, n_reads, 10000):
+        block = [ "@SIM:1:FC:1:%d:%d:%d 1:N:0:ACGTACGT\n%s\n+\n%s\n" % (i // 10000 + 1, i % 10000, i, random.choice(seqs), random.choice(quals))
+            for i in range(start, min(n_reads, start + 10000)) ]
+        fh.write("".join(block).encode())
+
+def run(infile, outfile, backend, percent, threads):
+    cmd = [ sys.executable, SAMPLE, "-p", str(percent), "-s", "1", "--backend", backend, infile, outfile ]
+    if threads:
+        cmd.extend([ "--threads", str(threads) ])
+    t0 = time.perf_counter()
+    out = subprocess.run(cmd, capture_output = True, text = True, check = True).stdout
+    elapsed = time.perf_counter() - t0
+    return elapsed, int(out.split()[-2])
+
+def main(args):
+    random.seed(args.seed)
+    tmpdir = tempfile.mkdtemp(dir = args.tmpdir)
+    try:
+        plain = os.path.join(tmpdir, "reads.fq")
+        with open(plain, "wb") as fh:
+            write_fastq(fh, args.reads, args.length)
+        size = os.path.getsize(plain)
+        inputs = [ ("gzip", os.path.join(tmpdir, "reads.fq.gz"), [ "gzip", "pigz", "zstd", "auto" ]),
+                   ("bgzf", os.path.join(tmpdir, "reads.bgzf.fq.gz"), [ "gzip", "bgzf", "pigz", "auto" ]) ]
+        with open(plain, "rb") as src, gzip.open(inputs[0][1], "wb", compresslevel = 6) as out:
+            shutil.copyfileobj(src, out, 4 << 20)
+        with open(plain, "rb") as src, gziptools.open_output(inputs[1][1], threads = args.threads) as out:
+            shutil.copyfileobj(src, out, 4 << 20)
+        if shutil.which("zstd"):
+            inputs.append(("zstd", plain + ".zst", [ "auto" ]))
+            subprocess.run([ "zstd", "-q", plain, "-o", inputs[-1][1] ], check = True)
+        os.remove(plain)
+
+        print("input: %d reads, %.1f MB uncompressed" % (args.reads, size / 1e6))
+        print("percent\tinput\tbackend\trecords\tseconds\tMB/s")
+        for percent in [ float(p) for p in args.percent.split(",") ]:
+            for fmt, infile, backends in inputs:
+                for backend in backends:
+                    if backend in ("pigz", "zstd") and not shutil.which(backend):
+                        continue
+                    outfile = os.path.join(tmpdir, "sample.fq." + ("zst" if backend == "zstd" else "gz"))
+                    elapsed, n = run(infile, outfile, backend, percent, args.threads)
+                    print("%g\t%s\t%s\t%d\t%.2f\t%.1f" % (percent, fmt, backend, n, elapsed, size / 1e6 / elapsed))
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    main(argparser.parse_args())
@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+
+"""
+Compare memory use and throughput of the old Phobos report parsing in
+phobos-statistics.py (a dict of lists of dicts, three regexes per line) with
+phobostools.load() on a synthetic report. Each engine runs in its own child
+process so that its peak memory (max RSS) can be measured separately.
+
+Usage: benchmark-phobos-parsing.py [--repeats 10000000] [--tmpdir DIR]
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import resource
+import argparse
+import tempfile
+import subprocess
+import phobostools
+
+argparser = argparse.ArgumentParser()
+argparser.add_argument("--repeats",   type = int, default = 10000000, help = "Number of repeats in the synthetic report (default: 10000000)")
+argparser.add_argument("--scaffolds", type = int, default = 10000, help = "Number of scaffolds (default: 10000)")
+argparser.add_argument("--tmpdir",    type = str, default = None, help = "Directory for the synthetic report")
+argparser.add_argument("--seed",      type = int, default = 42)
+argparser.add_argument("--run",       nargs = 2, metavar = ("ENGINE", "FILE"), help = argparse.SUPPRESS)
+
+UNITS = [ "A", "AT", "TTA", "ACG", "GATA", "CAGCA", "TTAGGG" ]
+
+def write_report(path, n_repeats, n_scaffolds):
+	per_scaffold = max(1, n_repeats // n_scaffolds)
+	written = 0
+	n = 0
+	with open(path, "w") as fh:
+		fh.write("# Results computed with: Phobos 3.3.12\n")
+		fh.write("# Input file name: synthetic.fa\n")
+		while written < n_repeats:
+			n += 1
+			fh.write(">scaffold_%d\n" % n)
+			fh.write("number of ACGTU characters: %d\n" % (per_scaffold * 100))
+			pos = 0
+			for i in range(min(per_scaffold, n_repeats - written)):
+				pos += random.randint(20, 180)
+				unit = random.choice(UNITS)
+				length = len(unit) * random.randint(3, 10)
+				fh.write("%12s%-14s%10d :%10d |   length %6d bp |   %3d mismatches |   unit %s\n" % (
+					"", "trinucleotide", pos, pos + length - 1, length, 0, unit))
+				written += 1
+
+def old_engine(path):
+	re_seq  = re.compile(r"^>(\S+_\d+)")
+	re_nucl = re.compile(r"^\s*\S+nucleotide\s+(\d+) :\s+(\d+)")
+	re_split = re.compile(r"\s+\|\s+")
+	data_for = { }
+	scaffold = ""
+	fh = open(path)
+	line = fh.readline()
+	for line in fh:
+		m = re.match(r"^# Input file name:\s+(\S+)$", line)
+		m = re_seq.match(line)
+		if m:
+			scaffold = m.group(1)
+			data_for[scaffold] = [ ]
+		m = re_nucl.match(line)
+		if m:
+			fields = re_split.split(line)
+			if fields:
+				data_for[scaffold].append({ 'start': int(m.group(1)), 'end': int(m.group(2)), 'unit': fields[-1][5:].rstrip() })
+	fh.close()
+	return sum(len(v) for v in data_for.values())
+
+def new_engine(path):
+	return len(phobostools.load(path))
+
+def run(engine, path):
+	t0 = time.perf_counter()
+	n = { "old": old_engine, "new": new_engine }[engine](path)
+	elapsed = time.perf_counter() - t0
+	maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # KiB on Linux
+	print("%d\t%f\t%d" % (n, elapsed, maxrss))
+
+def main(args):
+	if args.run:
+		run(*args.run)
+		return
+	random.seed(args.seed)
+	fd, path = tempfile.mkstemp(suffix = ".phobos", dir = args.tmpdir)
+	os.close(fd)
+	try:
+		write_report(path, args.repeats, args.scaffolds)
+		print("report: %d repeats, %.1f MB" % (args.repeats, os.path.getsize(path) / 1e6))
+		print("engine\tseconds\trepeats/s\tmax RSS (MB)")
+		for engine in ("old", "new"):
+			out = subprocess.run([ sys.executable, __file__, "--run", engine, path ], capture_output = True, text = True, check = True).stdout
+			n, elapsed, maxrss = out.split()
+			if int(n) != args.repeats:
+				sys.exit("Fatal: %s engine found %s repeats, expected %d" % (engine, n, args.repeats))
+			print("%s\t%.2f\t%.0f\t%.0f" % (engine, float(elapsed), int(n) / float(elapsed), int(maxrss) / 1024))
+	finally:
+		os.remove(path)
+
+if __name__ == '__main__':
+	main(argparser.parse_args())
@@ -0,0 +1,187 @@
+#!/usr/bin/python
+
+"""
+NumPy kernels for base composition in sliding windows. Sequences can be str,
+bytes or fastatools.SequenceView objects; they are converted to uint8 arrays
+chunk by chunk, so memory use does not depend on the sequence length.
+"""
+
+from __future__ import division
+import json
+import numpy as np
+
+# column order of the composition tables (same as the basecompo CSV)
+BASES = b"GCAT"
+
+# number of windows processed per chunk
+CHUNK = 1 << 16
+
+def as_bytes(seq, start = 0, end = None):
+	"""
+	Return seq[start:end] as bytes, whatever kind of sequence seq is.
+	"""
+	if isinstance(seq, str):
+		return seq[start:end].encode('latin-1')
+	if isinstance(seq, (bytes, bytearray, memoryview)):
+		return bytes(seq[start:end])
+	return seq.tobytes(start, end) # fastatools.SequenceView
+
+def window_count(length, winsize, step = None):
+	"""
+	Number of windows in a sequence of `length` bases. Like the original
+	basecompo loop, the last window must end before the end of the sequence.
+	"""
+	step = step if step else winsize
+	return len(range(0, max(length - winsize, 0), step))
+
+def window_starts(length, winsize, step = None, first = 0, last = None):
+	"""
+	0-based start positions of the windows, or of windows first to last - 1.
+	"""
+	step = step if step else winsize
+	if last is None:
+		last = window_count(length, winsize, step)
+	return np.arange(first, last, dtype = np.int64) * step
+
+def composition(seq, winsize, step = None, first = 0, last = None):
+	"""
+	Count G, C, A and T in every window of `winsize` bases, starting every
+	`step` bases (default: non-overlapping windows), or in windows first to
+	last - 1 only. Yields the windows in chunks of up to CHUNK windows: the
+	start positions and an array of counts with one row per window and one
+	column per base in BASES order. Only one chunk is held in memory.
+	"""
+	step = step if step else winsize
+	if last is None:
+		last = window_count(len(seq), winsize, step)
+	for k in range(first, last, CHUNK):
+		s = window_starts(len(seq), winsize, step, k, min(k + CHUNK, last))
+		counts = np.empty((len(s), len(BASES)), dtype = np.int64)
+		lo = int(s[0])
+		hi = int(s[-1]) + winsize
+		arr = np.frombuffer(as_bytes(seq, lo, hi), dtype = np.uint8)
+		if step == winsize:
+			# adjacent windows: reshape to one row per window and sum up
+			block = arr.reshape(len(s), winsize)
+			for j, base in enumerate(BASES):
+				counts[:, j] = np.count_nonzero(block == base, axis = 1)
+		else:
+			# overlapping or gapped windows: difference of cumulative sums
+			offsets = s - lo
+			cs = np.zeros(len(arr) + 1, dtype = np.int64)
+			for j, base in enumerate(BASES):
+				np.cumsum(arr == base, out = cs[1:])
+				counts[:, j] = cs[offsets + winsize] - cs[offsets]
+		yield s, counts
+
+def prefix_counts(seq):
+	"""
+	Cumulative base counts: prefix[j, i] is the number of BASES[j] in
+	seq[:i]. The composition of any range [start, end) is then
+	prefix[:, end] - prefix[:, start], in constant time.
+	"""
+	arr = np.frombuffer(as_bytes(seq), dtype = np.uint8)
+	dtype = np.uint32 if len(arr) < 2**32 else np.uint64
+	prefix = np.zeros((len(BASES), len(arr) + 1), dtype = dtype)
+	for j, base in enumerate(BASES):
+		np.cumsum(arr == base, dtype = dtype, out = prefix[j, 1:])
+	return prefix
+
+def csv_lines(starts, counts, winsize):
+	"""
+	Format windows as CSV text: 1-based position followed by the fraction of
+	each base, exactly as str(count / winsize) would print it. There are only
+	winsize + 1 possible fractions, so they are formatted once and looked up.
+	Yields one string per chunk of windows.
+	"""
+	labels = [ str(c / winsize) for c in range(winsize + 1) ]
+	for k in range(0, len(starts), CHUNK):
+		pos = (starts[k:k+CHUNK] + 1).tolist()
+		cols = [ [ labels[c] for c in col ] for col in counts[k:k+CHUNK].T.tolist() ]
+		yield "".join([ ",".join(row) + "\n" for row in zip(map(str, pos), *cols) ])
+
+class WindowWriter:
+	"""
+	Stream the windows of many sequences into one Parquet file instead of one
+	CSV file per sequence. Columns are header, pos (1-based) and one float
+	column per name in `columns`. Rows are buffered and written in row groups
+	of `row_group_size` rows. The windows of a sequence can be added in
+	several calls, one chunk at a time. On close, an index mapping each header to its
+	first row and number of rows is stored in the file metadata (key
+	"header_index"); see read_windows(). Requires pyarrow.
+	"""
+	def __init__(self, path, columns, row_group_size = 1 << 20, compression = 'zstd'):
+		try:
+			import pyarrow
+			import pyarrow.parquet
+		except ImportError:
+			raise ImportError("Parquet output requires the pyarrow module")
+		self.pa = pyarrow
+		self.columns = columns
+		self.row_group_size = row_group_size
+		self.schema = pyarrow.schema(
+			[ ('header', pyarrow.string()), ('pos', pyarrow.int64()) ] +
+			[ (c, pyarrow.float64()) for c in columns ]
+		)
+		self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression = compression)
+		self.batches = [ ]
+		self.buffered = 0
+		self.rows = 0
+		self.index = { }
+		self.last = None
+
+	def write(self, header, starts, values):
+		"""
+		Add windows of one sequence: 0-based start positions and a 2-d array
+		of values with one column per entry in `columns`. Consecutive calls
+		with the same header add to the same sequence.
+		"""
+		n = len(starts)
+		if not n:
+			return
+		pa = self.pa
+		arrays = [ pa.repeat(header, n), pa.array(starts + 1) ]
+		arrays.extend(pa.array(values[:, j]) for j in range(len(self.columns)))
+		self.batches.append(pa.RecordBatch.from_arrays(arrays, schema = self.schema))
+		if header == self.last:
+			first, m = self.index[header]
+			self.index[header] = (first, m + n)
+		else:
+			self.index[header] = (self.rows, n)
+			self.last = header
+		self.rows += n
+		self.buffered += n
+		if self.buffered >= self.row_group_size:
+			self.flush()
+
+	def flush(self):
+		if self.batches:
+			table = self.pa.Table.from_batches(self.batches, schema = self.schema)
+			self.writer.write_table(table, row_group_size = self.row_group_size)
+			self.batches = [ ]
+			self.buffered = 0
+
+	def close(self):
+		self.flush()
+		self.writer.add_key_value_metadata({ 'header_index': json.dumps(self.index) })
+		self.writer.close()
+
+def read_windows(path, header):
+	"""
+	Read the windows of one sequence from a file written by WindowWriter.
+	Only the row groups that contain the sequence are read.
+	"""
+	import pyarrow.parquet
+	pf = pyarrow.parquet.ParquetFile(path)
+	first, n = json.loads(pf.metadata.metadata[b'header_index'])[header]
+	groups = [ ]
+	offset = 0   # first row of the first selected row group
+	row = 0
+	for i in range(pf.metadata.num_row_groups):
+		size = pf.metadata.row_group(i).num_rows
+		if row + size > first and row < first + n:
+			if not groups:
+				offset = row
+			groups.append(i)
+		row += size
+	return pf.read_row_groups(groups).slice(first - offset, n)
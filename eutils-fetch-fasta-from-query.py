@@ -1,48 +1,56 @@
 #!/usr/bin/python3
 
-import requests
-import xml.etree.ElementTree as etree
 import argparse
 import sys
+import sqlite3
+import requests
+import eutilstools
 
 # parse command line arguments
 parser = argparse.ArgumentParser()
 parser.add_argument('-m', '--max',  action = 'store', dest = 'retmax', type = int,  default = 100,       help = 'Maximum number of entries. Default: 100')
 parser.add_argument('-d', '--db',   action = 'store', dest = 'db',     type = str,  default = 'nuccore', help = 'Database to search. Default: nuccore')
 parser.add_argument('-t', '--type', action = 'store', dest = 'rettype', type = str, default = 'fasta',   help = 'Return type. Default: fasta')
+parser.add_argument('-b', '--batch-size', action = 'store', dest = 'batch_size', type = int, default = 500, help = 'Number of entries per efetch request. Default: 500')
+parser.add_argument('-k', '--api-key', action = 'store', dest = 'api_key', type = str, default = None, help = 'NCBI API key (allows 10 instead of 3 requests per second). Default: $NCBI_API_KEY')
+parser.add_argument('-r', '--rate', action = 'store', dest = 'rate', type = float, default = None, help = 'Maximum number of requests per second. Default: 3, or 10 with an API key')
+parser.add_argument('-j', '--jobs', action = 'store', dest = 'jobs', type = int, default = 1, help = 'Number of efetch requests in flight at the same time, within the rate limit. Default: 1')
+parser.add_argument('--retries', action = 'store', dest = 'retries', type = int, default = 3, help = 'Number of retries for failed requests. Default: 3')
+parser.add_argument('--base-url', action = 'store', dest = 'base_url', type = str, default = eutilstools.BASE_URL, help = 'E-utilities base URL. Default: ' + eutilstools.BASE_URL)
 parser.add_argument('search_terms', nargs = '+',      help = 'Search terms')
+eutilstools.add_cache_arguments(parser)
 args = parser.parse_args()
 
 # some variables
-base_url = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils'
-esearch  = base_url + '/esearch.fcgi'
-efetch   = base_url + '/efetch.fcgi'
 db       = args.db
 rettype  = args.rettype
 retmax   = args.retmax
-term     = '+'.join(args.terms)
-
-sys.stderr.write("Searching for: %s\n" % ' '.join(args.terms))
-
-# esearch request
-url   = "%s?db=%s&retmax=%d&term=%s" % (esearch, db, retmax, term)
-sys.stderr.write("Request: %s\n" % url)
-r = requests.get(url)
-
-# parse XML
-doc     = etree.fromstring(r.text)
-IdList  = doc.findall('./IdList/Id')
-
-# exit now if nothing returned
-if len(IdList) == 0:
-    sys.stderr.write("Nothing found.\n")
-    sys.exit(1)
-
-# fetch fasta for each id: make comma-separated id list
-ids = ','.join( [ Id.text for Id in IdList ] )
-
-# efetch them all in one go and print
-url = "%s?db=%s&rettype=%s&id=%s" % (efetch, db, rettype, ids)
-sys.stderr.write("Request: %s\n" % url)
-r   = requests.get(url)
-print(r.text.replace("\n\n", "\n").strip())
+term     = ' '.join(args.search_terms)
+
+sys.stderr.write("Searching for: %s\n" % term)
+
+try:
+    client = eutilstools.EutilsClient(args.base_url, api_key = args.api_key, rate = args.rate, verbose = True, retries = args.retries,
+        pool_size = max(10, args.jobs), cache = eutilstools.cache_from_args(args), offline = args.offline)
+except (ValueError, sqlite3.Error) as e:
+    sys.exit("Fatal: %s" % e)
+
+try:
+    # esearch request, the results stay on the history server
+    search = client.esearch(db, term)
+
+    # exit now if nothing returned
+    if search['count'] == 0:
+        sys.stderr.write("Nothing found.\n")
+        sys.exit(1)
+
+    # efetch them in batches and print the batches in order as they arrive
+    for text in client.efetch_batches(db, search, rettype, retmax = retmax, batch_size = args.batch_size, workers = args.jobs):
+        text = text.replace("\n\n", "\n").strip()
+        if text:
+            sys.stdout.write(text + "\n")
+            sys.stdout.flush()
+except (requests.RequestException, eutilstools.EutilsError) as e:
+    sys.exit("Fatal: %s" % e)
+finally:
+    client.close()
@@ -1,12 +1,16 @@
 #!/usr/bin/python
 
-import xml.etree.ElementTree as etree
 import requests
+import sqlite3
 import sys
 import argparse
+import eutilstools
 
 parser = argparse.ArgumentParser()
 parser.add_argument('term', help = 'Search terms. Can be string or accession number')
+parser.add_argument('-k', '--api-key', help = 'NCBI API key. Default: $NCBI_API_KEY')
+parser.add_argument('--base-url', default = eutilstools.BASE_URL, help = 'E-utilities base URL. Default: ' + eutilstools.BASE_URL)
+eutilstools.add_cache_arguments(parser)
 args = parser.parse_args()
 
 term = '+'.join([args.term])
@@ -37,31 +41,27 @@ def url_from_accession(base_url, accession):
 # so we have the URL, but we still need the assembly name!
 # use efetch/esummary for that.
 
-eutils_url = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils'
-esearch  = eutils_url + '/esearch.fcgi'
-esummary = eutils_url + '/esummary.fcgi'
+try:
+    client = eutilstools.EutilsClient(args.base_url, api_key = args.api_key, cache = eutilstools.cache_from_args(args), offline = args.offline)
+except (ValueError, sqlite3.Error) as e:
+    sys.exit("Fatal: %s" % e)
 
-esearch_url = "%s?db=genome&term=%s" % ( esearch, term )
-r = requests.get(esearch_url)
+try:
+    IdList = client.esearch('genome', args.term, retmax = 20, usehistory = False)['ids']
 
-# parse XML
-doc     = etree.fromstring(r.text)
-IdList  = doc.findall('./IdList/Id')
-
-# exit now if nothing returned
-if len(IdList) == 0:
-    sys.stderr.write("Nothing found.\n")
-    sys.exit(1)
-
-# fetch fasta for each id: make comma-separated id list
-ids = ','.join( [ Id.text for Id in IdList ] )
+    # exit now if nothing returned
+    if len(IdList) == 0:
+        sys.stderr.write("Nothing found.\n")
+        sys.exit(1)
 
-# get the summary for that ID
-esummary_url = "%s?db=genome&id=%s" % ( esummary, ids )
-r = requests.get(esummary_url)
+    # get the summary for those IDs
+    doc = client.esummary('genome', IdList)
+except (requests.RequestException, eutilstools.EutilsError) as e:
+    sys.exit("Fatal: %s" % e)
+finally:
+    client.close()
 
 # parse XML
-doc     = etree.fromstring(r.text)
 name  = doc.findall("./DocSum/Item[@Name='Assembly_Name']")[0]
 name = name.text.replace(' ', '_')
 accession  = doc.findall("./DocSum/Item[@Name='Assembly_Accession']")[0].text
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+
+"""
+Shared NCBI E-utilities client for the eutils-*.py scripts.
+
+All requests go through one pooled requests.Session and a token bucket that
+keeps us under the NCBI limit (3 requests per second, 10 with an API key).
+Searches use the history server (usehistory=y), so efetch can page through
+any number of results with WebEnv/query_key and retstart/retmax instead of
+putting all IDs into one URL. With workers > 1, several efetch batches are
+downloaded at the same time (still within the rate limit) and handed out in
+their original order. Failed requests are retried with exponential backoff.
+
+Responses can be kept in a ResponseCache, an SQLite file keyed on the
+normalised request parameters, so that repeated runs on the same queries
+need no round trips at all. In offline mode, only the cache is used.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import random
+import sqlite3
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import xml.etree.ElementTree as etree
+import requests
+
+BASE_URL = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils'
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'eutils-cache.sqlite')
+
+# parameters that identify the user, not the request
+IDENTITY_PARAMS = ('api_key', 'email', 'tool')
+
+# error message in a response, which NCBI sends with status 200
+ERROR_RE = re.compile(r'<ERROR>(.*?)</ERROR>', re.S)
+
+class TokenBucket:
+    """
+    Allow `rate` requests per second on average, with bursts of up to `burst`
+    requests. acquire() blocks until a token is available; it is thread-safe.
+    """
+    def __init__(self, rate, burst = 1):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                time.sleep((1 - self.tokens) / self.rate)
+
+class EutilsError(Exception):
+    pass
+
+class ResponseCache:
+    """
+    Persistent response cache in an SQLite file. Entries are keyed on the
+    SHA-256 of the endpoint and the normalised request parameters, and the
+    bodies are stored zlib-compressed. Entries older than `ttl` seconds are
+    not used (0: no expiry). If the bodies take more than `max_size` bytes
+    in total, the least recently used entries are removed. The file can be
+    shared by several processes.
+    """
+    def __init__(self, path = DEFAULT_CACHE, ttl = 30 * 86400, max_size = 1 << 30):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+        self.db = sqlite3.connect(path, timeout = 60, isolation_level = None, check_same_thread = False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, endpoint TEXT, '
+            'body BLOB, size INTEGER, created REAL, accessed REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self.lock = threading.Lock()
+        self.total = self.size()
+
+    @staticmethod
+    def key(endpoint, params):
+        """
+        Cache key for a request: parameter names in lower case, values as
+        strings with whitespace runs collapsed, identity parameters left out,
+        sorted by name.
+        """
+        norm = sorted((k.lower(), ' '.join(str(v).split())) for k, v in params.items() if k.lower() not in IDENTITY_PARAMS)
+        return hashlib.sha256(json.dumps([ endpoint, norm ]).encode()).hexdigest()
+
+    def size(self):
+        return self.db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def get(self, key, stale = False):
+        """
+        Return the cached body for `key`, or None. Expired entries are only
+        returned with stale = True (offline mode).
+        """
+        with self.lock:
+            row = self.db.execute('SELECT body, created FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if self.ttl and now - row[1] > self.ttl and not stale:
+                return None
+            self.db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+            return zlib.decompress(row[0]).decode('utf-8')
+
+    def put(self, key, endpoint, text):
+        body = zlib.compress(text.encode('utf-8'))
+        now = time.time()
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)', (key, endpoint, body, len(body), now, now))
+            self.total += len(body)
+            if self.total > self.max_size:
+                self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache is down to 90%
+        of max_size. Other processes may have changed the cache, so the total
+        size is counted again first.
+        """
+        self.total = self.size()
+        target = self.max_size * 0.9
+        while self.total > target:
+            rows = self.db.execute('SELECT key, size FROM responses ORDER BY accessed LIMIT 1000').fetchall()
+            if not rows:
+                break
+            drop = [ ]
+            for key, size in rows:
+                if self.total <= target:
+                    break
+                drop.append((key,))
+                self.total -= size
+            self.db.executemany('DELETE FROM responses WHERE key = ?', drop)
+
+    def close(self):
+        self.db.close()
+
+class EutilsClient:
+    """
+    Minimal E-utilities client. The API key is taken from the NCBI_API_KEY
+    environment variable if not given. `base_url` can point to a local mock
+    server for testing. Connection errors, timeouts, HTTP 429 and 5xx errors
+    are retried up to `retries` times, waiting backoff * 2^attempt seconds
+    (plus some jitter) in between. With a ResponseCache, responses are looked
+    up there first; with offline = True, a cache miss is an error.
+    """
+    def __init__(self, base_url = BASE_URL, api_key = None, email = None, tool = 'eutilstools', rate = None, timeout = 60, pool_size = 10, verbose = False, retries = 3, backoff = 1.0, cache = None, offline = False):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key if api_key else os.environ.get('NCBI_API_KEY')
+        self.email = email
+        self.tool = tool
+        self.timeout = timeout
+        self.verbose = verbose
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = cache
+        self.offline = offline
+        self.search_lock = threading.Lock()
+        if offline and cache is None:
+            raise ValueError("offline mode needs a cache")
+        if rate is None:
+            rate = 10 if self.api_key else 3
+        self.bucket = TokenBucket(rate)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections = pool_size, pool_maxsize = pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def request(self, endpoint, params, key_params = None):
+        """
+        Return the response body of a request to `endpoint` (e.g. 'esearch')
+        as text, from the cache if possible. `key_params` replaces `params`
+        in the cache key.
+        """
+        return self.cached_request(endpoint, params, key_params)[0]
+
+    def cached_request(self, endpoint, params, key_params = None):
+        """
+        Like request(), but returns (text, True if it came from the cache).
+        """
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(endpoint, params if key_params is None else key_params)
+            text = self.cache.get(key, stale = self.offline)
+            if text is not None:
+                return text, True
+        if self.offline:
+            raise EutilsError("%s request not in the cache (offline mode)" % endpoint)
+        text = self.fetch(endpoint, params)
+        if key is not None:
+            self.cache.put(key, endpoint, text)
+        return text, False
+
+    def fetch(self, endpoint, params):
+        """
+        Make one rate-limited request to `endpoint` and return the response
+        body as text. Long parameter lists (many IDs) are sent by POST.
+        """
+        params = dict(params)
+        for key, value in (('api_key', self.api_key), ('email', self.email), ('tool', self.tool)):
+            if value:
+                params[key] = value
+        url = '%s/%s.fcgi' % (self.base_url, endpoint)
+        if self.verbose:
+            sys.stderr.write("Request: %s %s\n" % (url, ' '.join('%s=%s' % (k, v) for k, v in params.items() if k != 'api_key')[:200]))
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            try:
+                if len(str(params.get('id', ''))) > 200:
+                    r = self.session.post(url, data = params, timeout = self.timeout)
+                else:
+                    r = self.session.get(url, params = params, timeout = self.timeout)
+                r.raise_for_status()
+                return self.check(r.text)
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                status = e.response.status_code if e.response is not None else None
+                if attempt == self.retries or (status is not None and status != 429 and status < 500):
+                    raise
+                wait = self.backoff * 2 ** attempt * (1 + random.random() / 2)
+                sys.stderr.write("Request failed (%s), retrying in %.1f s\n" % (e, wait))
+                time.sleep(wait)
+
+    @staticmethod
+    def check(text):
+        """
+        Return `text`, or raise EutilsError if it is an error message, so
+        that errors are never cached.
+        """
+        error = ERROR_RE.search(text)
+        if error is not None:
+            raise EutilsError(error.group(1).strip())
+        return text
+
+    def request_xml(self, endpoint, params):
+        return self.parse_xml(self.request(endpoint, params))
+
+    @staticmethod
+    def parse_xml(text):
+        doc = etree.fromstring(text)
+        error = doc.find('./ERROR')
+        if error is not None:
+            raise EutilsError(error.text)
+        return doc
+
+    def esearch(self, db, term, retmax = 0, usehistory = True):
+        """
+        Search `db` for `term`. Returns a dict with the total 'count', the
+        first `retmax` 'ids', and 'webenv' and 'query_key' for the history
+        server. 'params', 'cached' and 'digest' (a hash of the response)
+        record how the result was obtained, for efetch_batch().
+        """
+        params = { 'db': db, 'term': term, 'retmax': retmax }
+        if usehistory:
+            params['usehistory'] = 'y'
+        text, cached = self.cached_request('esearch', params)
+        return self.search_result(text, params, cached)
+
+    def search_result(self, text, params, cached):
+        doc = self.parse_xml(text)
+        return {
+            'count':     int(doc.findtext('./Count', '0')),
+            'ids':       [ Id.text for Id in doc.findall('./IdList/Id') ],
+            'webenv':    doc.findtext('./WebEnv'),
+            'query_key': doc.findtext('./QueryKey'),
+            'params':    params,
+            'cached':    cached,
+            'digest':    hashlib.sha256(text.encode('utf-8')).hexdigest(),
+        }
+
+    def refresh_search(self, search):
+        """
+        Repeat a cached esearch over the network, to get a WebEnv that is
+        still valid on the history server, and update `search` in place.
+        The batches cached for the old search are not used any more. If the
+        number of results changed, the batches already downloaded belong to
+        a different result set, so EutilsError is raised; the next run
+        starts over with the new search.
+        """
+        with self.search_lock:
+            if search.get('changed'):
+                raise EutilsError(search['changed'])
+            if not search['cached']:
+                return # another thread was faster
+            text = self.fetch('esearch', search['params'])
+            self.cache.put(self.cache.key('esearch', search['params']), 'esearch', text)
+            fresh = self.search_result(text, search['params'], False)
+            if fresh['count'] != search['count']:
+                search['changed'] = ("the search results changed since they were cached (%d instead of %d records), run again to download them from the start"
+                    % (fresh['count'], search['count']))
+                raise EutilsError(search['changed'])
+            search.update(webenv = fresh['webenv'], query_key = fresh['query_key'], digest = fresh['digest'], cached = False)
+
+    def esummary(self, db, ids):
+        """
+        Return the esummary XML document for a list of IDs.
+        """
+        return self.request_xml('esummary', { 'db': db, 'id': ','.join(ids) })
+
+    def efetch_batches(self, db, search, rettype = 'fasta', retmode = 'text', retmax = None, batch_size = 500, workers = 1):
+        """
+        Page through the results of an esearch() on the history server and
+        yield the efetch result text of each batch of `batch_size` records,
+        up to `retmax` records in total. With workers > 1, up to 2 * workers
+        batches are requested ahead in a thread pool; the batches are still
+        yielded in order, so a slow batch holds back the ones after it.
+        """
+        total = search['count'] if retmax is None else min(retmax, search['count'])
+        batches = [ self.efetch_params(db, search, rettype, retmode, start, min(batch_size, total - start))
+            for start in range(0, total, batch_size) ]
+        if workers <= 1:
+            for params in batches:
+                yield self.efetch_batch(search, params)
+            return
+        with ThreadPoolExecutor(workers) as executor:
+            pending = deque()   # futures in batch order
+            try:
+                for params in batches:
+                    pending.append(executor.submit(self.efetch_batch, search, params))
+                    if len(pending) >= 2 * workers:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for f in pending:
+                    f.cancel()
+
+    def efetch_batch(self, search, params):
+        """
+        Fetch one batch. The cache key has the hash of the esearch response
+        in place of WebEnv and query_key, so cached batches are only used
+        together with the cached search they came from. On a cache miss
+        after a cached esearch, the WebEnv may have expired on the history
+        server, so the search is repeated first.
+        """
+        if self.cache is not None and not self.offline and search['cached']:
+            if self.cache.get(self.cache.key('efetch', self.batch_key(search, params))) is None:
+                self.refresh_search(search)
+        with self.search_lock:
+            key_params = self.batch_key(search, params)
+            params = dict(params, WebEnv = search['webenv'], query_key = search['query_key'])
+        return self.request('efetch', params, key_params)
+
+    def batch_key(self, search, params):
+        return dict(params, WebEnv = None, query_key = None, search = search['digest'])
+
+    def efetch_params(self, db, search, rettype, retmode, start, n):
+        return { 'db': db, 'WebEnv': search['webenv'], 'query_key': search['query_key'],
+            'rettype': rettype, 'retmode': retmode, 'retstart': start, 'retmax': n }
+
+def add_cache_arguments(parser):
+    """
+    Add the response cache options to an argparse parser.
+    """
+    parser.add_argument('--cache', action = 'store', dest = 'cache', type = str, default = DEFAULT_CACHE, help = 'Response cache file. Default: ' + DEFAULT_CACHE)
+    parser.add_argument('--no-cache', action = 'store_true', dest = 'no_cache', help = 'Do not use the response cache')
+    parser.add_argument('--offline', action = 'store_true', dest = 'offline', help = 'Only use the response cache, make no requests')
+    parser.add_argument('--cache-ttl', action = 'store', dest = 'cache_ttl', type = float, default = 30, help = 'Days after which cached responses are fetched again, 0 for never. Default: 30')
+    parser.add_argument('--cache-size', action = 'store', dest = 'cache_size', type = float, default = 1024, help = 'Maximum size of the response cache in MB. Default: 1024')
+
+def cache_from_args(args):
+    """
+    Open the ResponseCache given by the add_cache_arguments() options, or
+    return None with --no-cache.
+    """
+    if args.no_cache:
+        if args.offline:
+            raise ValueError("--offline needs the cache")
+        return None
+    return ResponseCache(args.cache, ttl = args.cache_ttl * 86400, max_size = int(args.cache_size * (1 << 20)))
@@ -1,46 +1,333 @@
 #!/usr/bin/python
 
+import os
+import mmap
+from collections import namedtuple
+
+# size of the binary blocks read by the block parser (4 MiB)
+BLOCKSIZE = 1 << 22
+
+# trailing whitespace removed from every sequence line, like str.rstrip()
+WHITESPACE = b" \t\r\n\x0b\x0c"
+
 class FastaFile:
-	def __init__(self, inf):
+	def __init__(self, inf, blocksize = BLOCKSIZE, encoding = "utf-8", mmap = False):
 		self.filename = inf
-		self.fh = open(self.filename)
-	
+		self.blocksize = blocksize
+		self.encoding = encoding
+		self.fh = open(self.filename, 'rb')
+		self.mm = None
+		self.index = None
+		if mmap:
+			self.open_mmap()
+
+	def open_mmap(self):
+		"""
+		Memory-map the file and index it, so that sequences can be handed out
+		as lazy SequenceView objects instead of str.
+		"""
+		self.index = FastaIndex(self.filename)
+		if os.path.getsize(self.filename) > 0:
+			self.mm = mmap.mmap(self.fh.fileno(), 0, access = mmap.ACCESS_READ)
+
 	def next_seq(self):
+		if self.index is not None:
+			return self.views()
 		return self.parse(self.fh)
 
+	def records(self):
+		"""
+		Yield (header, sequence) pairs as bytes. This is the fast path: no
+		decoding and no per-line Python work.
+		"""
+		return parse_bytes(self.fh, self.blocksize)
+
 	def parse(self, handle):
-		# test whether the file starts with a > (i.e., is a valid fasta file)
+		"""
+		Compatibility layer: yield (header, sequence) pairs as str, like the
+		old line-based parser did.
+		"""
+		# accept text handles, too, by going to the underlying binary buffer
+		handle = getattr(handle, 'buffer', handle)
+		for header, seq in parse_bytes(handle, self.blocksize):
+			yield header.decode(self.encoding), seq.decode(self.encoding)
+
+	def views(self):
+		"""
+		Yield (header, SequenceView) pairs in file order (mmap mode only).
+		"""
+		for name in self.index:
+			yield self.view(name)
+
+	def view(self, name):
+		"""
+		Return (header, SequenceView) for the sequence `name` (mmap mode only).
+		The header is the complete header line, as with parse().
+		"""
+		entry = self.index.entries[name]
+		start = self.mm.rfind(b"\n>", 0, entry.offset) + 1
+		header = self.mm[start+1:entry.offset].rstrip()
+		return header.decode(self.encoding), SequenceView(self.mm, entry)
+
+	def close(self):
+		if self.mm is not None:
+			self.mm.close()
+		if self.index is not None:
+			self.index.close()
+		self.fh.close()
+
+class SequenceView:
+	"""
+	Lazy, read-only view of one sequence in a memory-mapped Fasta file. Nothing
+	is read until the view is sliced; slices skip the line breaks and are
+	returned as str, so a view can stand in for a sequence string in code that
+	only uses len() and slicing.
+	"""
+	def __init__(self, mm, entry):
+		self.mm = mm
+		self.entry = entry
+
+	def __len__(self):
+		return self.entry.length
+
+	def __getitem__(self, key):
+		if isinstance(key, slice):
+			start, stop, step = key.indices(self.entry.length)
+			if step == 1:
+				return self.tobytes(start, stop).decode('ascii')
+			return "".join(self[i] for i in range(start, stop, step))
+		if key < 0:
+			key += self.entry.length
+		if key < 0 or key >= self.entry.length:
+			raise IndexError("sequence index out of range")
+		return self.tobytes(key, key + 1).decode('ascii')
+
+	def tobytes(self, start = 0, end = None):
+		"""
+		Return the bases [start, end) as bytes, without line breaks.
+		"""
+		e = self.entry
+		start = max(0, start)
+		end = e.length if end is None else min(end, e.length)
+		if start >= end:
+			return b""
+		first = FastaIndex.file_offset(e, start)
+		last  = FastaIndex.file_offset(e, end - 1)
+		return self.mm[first:last+1].translate(None, b"\r\n")
+
+	def windows(self, size, step = None):
+		"""
+		Yield (position, window) for every complete window of `size` bases,
+		starting every `step` bases (default: non-overlapping windows). Only
+		one window is held in memory at a time.
+		"""
+		step = step if step else size
+		for i in range(0, self.entry.length - size + 1, step):
+			yield i, self.tobytes(i, i + size).decode('ascii')
+
+# one line of a .fai file: sequence name, number of bases, byte offset of the
+# first base, bases per line, bytes per line (including the line break)
+FaiEntry = namedtuple('FaiEntry', [ 'name', 'length', 'offset', 'linebases', 'linewidth' ])
+
+class FastaIndex:
+	"""
+	samtools-compatible Fasta index. Loads <fasta>.fai if it exists and is not
+	older than the Fasta file, otherwise builds it (and tries to write it).
+	fetch() seeks directly to the requested region using the line length
+	arithmetic, so only the bytes of that region are read.
+	"""
+	def __init__(self, fasta, fai = None):
+		self.filename = fasta
+		self.fai = fai if fai else fasta + ".fai"
+		self.entries = { }
+		if os.path.exists(self.fai) and os.path.getmtime(self.fai) >= os.path.getmtime(fasta):
+			self.load()
+		else:
+			self.build()
+			try:
+				self.write()
+			except (IOError, OSError):
+				pass # read-only location, the index just lives in memory then
+		self.fh = open(self.filename, 'rb')
+
+	def __contains__(self, name):
+		return name in self.entries
+
+	def __iter__(self):
+		return iter(self.entries)
+
+	def __len__(self):
+		return len(self.entries)
+
+	def length(self, name):
+		return self.entries[name].length
+
+	def load(self):
+		with open(self.fai) as fh:
+			for line in fh:
+				fields = line.rstrip("\n").split("\t")
+				if len(fields) < 5:
+					raise ValueError("Invalid Fasta index line: " + line)
+				entry = FaiEntry(fields[0], *[ int(x) for x in fields[1:5] ])
+				self.entries[entry.name] = entry
+
+	def build(self):
+		"""
+		Scan the Fasta file once and record name, length, offset and line
+		layout of every sequence. Like samtools, sequences must have the same
+		line length throughout (except for the last line).
+		"""
+		self.entries = { }
+		name = None
+		offset = 0
+		with open(self.filename, 'rb') as fh:
+			for line in fh:
+				if line[:1] == b">":
+					if name is not None:
+						self._add(name, length, seqoffset, linebases, linewidth)
+					fields = line[1:].split(None, 1)
+					name = fields[0].decode() if fields else ""
+					seqoffset = offset + len(line)
+					length = 0
+					linebases = linewidth = 0
+					short_line = False
+				elif name is None:
+					raise ValueError("Invalid Fasta file format")
+				else:
+					bases = len(line.rstrip(b"\r\n"))
+					if short_line and bases:
+						raise ValueError("Different line length in sequence '%s'" % name)
+					if linewidth == 0:
+						linebases, linewidth = bases, len(line)
+					elif bases != linebases or len(line) != linewidth:
+						short_line = True
+					length += bases
+				offset += len(line)
+		if name is not None:
+			self._add(name, length, seqoffset, linebases, linewidth)
+
+	def _add(self, name, length, offset, linebases, linewidth):
+		if name in self.entries:
+			raise ValueError("Duplicate sequence name '%s'" % name)
+		self.entries[name] = FaiEntry(name, length, offset, linebases, linewidth)
+
+	def write(self):
+		with open(self.fai, 'w') as fh:
+			for e in self.entries.values():
+				fh.write("%s\t%d\t%d\t%d\t%d\n" % e)
+
+	def fetch(self, name, start = 0, end = None):
+		"""
+		Return the bases [start, end) (0-based, half-open) of sequence `name`
+		as bytes, without line breaks.
+		"""
+		e = self.entries[name]
+		start = max(0, start)
+		end = e.length if end is None else min(end, e.length)
+		if start >= end:
+			return b""
+		first = self.file_offset(e, start)
+		last  = self.file_offset(e, end - 1)
+		self.fh.seek(first)
+		return self.fh.read(last - first + 1).translate(None, b"\r\n")
+
+	@staticmethod
+	def file_offset(entry, pos):
+		"""
+		Byte offset of base `pos` (0-based) of a sequence in the Fasta file.
+		"""
+		return entry.offset + (pos // entry.linebases) * entry.linewidth + pos % entry.linebases
+
+	def close(self):
+		self.fh.close()
+
+def parse_bytes(handle, blocksize = BLOCKSIZE):
+	"""
+	Block-buffered Fasta parser. Reads the binary handle in large blocks, finds
+	record boundaries ("\\n>") with bytes.find and yields (header, sequence)
+	pairs as bytes. Line breaks and trailing whitespace are removed from the
+	sequence.
+	"""
+	block = handle.read(blocksize)
+	if not block:
+		return
+	# test whether the file starts with a > (i.e., is a valid fasta file)
+	if block[:1] != b">":
+		raise ValueError("Invalid Fasta file format")
+
+	pieces = [ ]   # parts of the current record, which may span several blocks
+	tail = b""     # last byte of the previous block
+	while True:
+		start = 0
+		# a record boundary may fall exactly between two blocks
+		if tail == b"\n" and block[:1] == b">" and pieces:
+			yield _make_record(b"".join(pieces))
+			pieces = [ ]
 		while True:
-			line = handle.readline()
-			if line == "":
-				return
-			if line[0] != ">":
-				raise ValueError("Invalid Fasta file format")  # premature end of file
-			else:
+			end = block.find(b"\n>", start)
+			if end == -1:
 				break
-		
-		while True:
-			if line[0] != ">":
-				raise ValueError("Records in Fasta files should start with '>' character")
+			pieces.append(block[start:end+1])
+			yield _make_record(b"".join(pieces))
+			pieces = [ ]
+			start = end + 1
+		pieces.append(block[start:])
+		tail = block[-1:]
+		block = handle.read(blocksize)
+		if not block:
+			break
 
-			# remove '>' and trailing whitespace
-			header = line[1:].rstrip()
-			lines = []
+	yield _make_record(b"".join(pieces))
 
-			# a sequence, keep reading lines until you reach the next '>'
-			line = handle.readline()
-			while True: 
-				if not line:
-					break  # eof reached
-				if line[0] == ">":
-					break
-				lines.append(line.rstrip())
-				line = handle.readline()
+def _make_record(raw):
+	"""
+	Split one raw record (starting with '>') into header and sequence.
+	"""
+	if raw[:1] != b">":
+		raise ValueError("Records in Fasta files should start with '>' character")
+	eol = raw.find(b"\n")
+	if eol == -1:
+		return raw[1:].rstrip(), b""
+	# remove '>' and trailing whitespace
+	header = raw[1:eol].rstrip()
+	return header, raw[eol+1:].translate(None, WHITESPACE)
+
+def parse_lines(handle):
+	"""
+	The original line-based parser. Reads a text handle one line at a time.
+	Kept for reference and benchmarking; prefer FastaFile or parse_bytes().
+	"""
+	# test whether the file starts with a > (i.e., is a valid fasta file)
+	while True:
+		line = handle.readline()
+		if line == "":
+			return
+		if line[0] != ">":
+			raise ValueError("Invalid Fasta file format")  # premature end of file
+		else:
+			break
 
-			yield header, "".join(lines)
+	while True:
+		if line[0] != ">":
+			raise ValueError("Records in Fasta files should start with '>' character")
 
+		# remove '>' and trailing whitespace
+		header = line[1:].rstrip()
+		lines = []
+
+		# a sequence, keep reading lines until you reach the next '>'
+		line = handle.readline()
+		while True:
 			if not line:
-				return
-		
-		assert False, "Error: Should not reach this line!"
+				break  # eof reached
+			if line[0] == ">":
+				break
+			lines.append(line.rstrip())
+			line = handle.readline()
+
+		yield header, "".join(lines)
+
+		if not line:
+			return
 
+	assert False, "Error: Should not reach this line!"
@@ -2,16 +2,27 @@
 
 """
 Demultiplex one or more FASTQ files by barcode. The input files can be gzip
-compressed or not (determined by the file extension). The FASTQ header must be
+or zstd compressed or not (determined by the file extension). The FASTQ header must be
 in Illumina format with colon-separated fields, the last one of which contains
 the barcode sequence.
 
-Usage: fastq-demultiplex.py samples.csv reads.fastq [reads.fastq, ...] 
+Usage: fastq-demultiplex.py [options] samples.csv reads.fastq [reads.fastq, ...] 
 
 This script requires two arguments: 
 (1) path to the dictionary file
 (2) path to the FASTQ file
 
+Output is buffered in memory and written in large blocks. The options
+--compresslevel, --buffer-size and --max-open-files control the gzip
+compression level, the per-sample buffer size (in MB), and how many output
+files are kept open at the same time.
+
+--backend selects how gzip files are read and written (see gziptools.py).
+The default reads BGZF input and writes BGZF output (which is valid gzip)
+in --threads parallel threads, and reads other gzip input through pigz if
+it is installed. With --backend zstd, the output files are written as zstd
+and named .fq.zst instead of .fq.gz.
+
 The dictionary file specifies which barcode belongs to which sample. It must be
 in comma-separated text format, with each line looking like this:
 
@@ -22,25 +33,137 @@ are named according to the sample names listed in the dictionary and are
 deleted if they exist. Reads that could not be assigned to a sample (orphans)
 are placed in an additional output file named "orphans.fq.gz". This means that
 no sample must be named "orphans".
+
+With --mismatches K, barcodes with up to K mismatches are assigned as well.
+The lookup table with all barcode variants is built once at the start; the
+script refuses to run if the barcodes of two samples are K or fewer mismatches
+apart. Reads whose barcode is equally close to several samples are counted as
+ambiguous, reported, and written to the orphans file.
+
+With --jobs N, each input file is processed by a pipeline: a reader process
+decompresses the input and cuts it into blocks of complete records, N worker
+processes assign the records to samples, and --writer-threads threads compress
+the output. The stages are connected by bounded queues. Blocks are written in
+input order, so the output is the same as in serial mode.
+
+With --paired, the FASTQ files are taken as R1/R2 pairs (R1 R2 [R1 R2 ...]).
+Both files are read in lockstep, each pair is assigned by the barcode in the
+R1 header, and the reads go to <sample>_R1.fq.gz and <sample>_R2.fq.gz. For
+dual-indexed runs, the barcode field looks like "CCGCGGTT+AGCTAGCT" (i7+i5);
+the dictionary then lists both indices, either as one field joined by "+" or
+as a third column:
+
+    Sample1,CCGCGGTT,AGCTAGCT
+
+With --mismatches, each index may have up to K mismatches.
+
+While running, throughput (reads/s and MB/s of uncompressed input), the time
+spent on decompression, classification and compression, and the most frequent
+unmatched barcodes are printed to stderr every --report-interval seconds. The
+unmatched barcodes are counted approximately in fixed memory. --json-report
+writes all counts and statistics to a JSON file at the end.
 """
 
 import os   # OS calls
 import sys  # variables such as ARGV
-import gzip # read and write gzip'ed files
 import csv  # parse CSV files
+import json
+import time
+import signal
+import threading
+import argparse
+import multiprocessing
+import fastqtools
+import gziptools
+
+class RunStats:
+    """
+    collect throughput and timing statistics, and print a progress line to
+    stderr every `interval` seconds (never if interval is 0)
+    """
+    def __init__(self, interval = 30, top = 10):
+        self.interval = interval
+        self.top = top
+        self.start = time.time()
+        self.last_report = self.start
+        self.reads = 0
+        self.bytes = 0
+        self.seconds = { 'decompress': 0.0, 'classify': 0.0, 'compress': 0.0 }
+        # bounded heavy-hitter counts of the barcodes that end up in orphans
+        self.unmatched = fastqtools.SpaceSaving(max(1000, 100 * top))
+
+    def add(self, reads, nbytes, read_seconds, classify_seconds, unmatched):
+        self.reads += reads
+        self.bytes += nbytes
+        self.seconds['decompress'] += read_seconds
+        self.seconds['classify'] += classify_seconds
+        self.unmatched.update(unmatched)
+
+    def elapsed(self):
+        return time.time() - self.start
+
+    def maybe_report(self, compress_seconds):
+        now = time.time()
+        if self.interval and now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report(compress_seconds)
+
+    def report(self, compress_seconds):
+        self.seconds['compress'] = compress_seconds
+        elapsed = max(self.elapsed(), 1e-9)
+        sys.stderr.write("[%s] %d reads, %.0f reads/s, %.1f MB/s; decompress %.1f s, classify %.1f s, compress %.1f s\n" % (
+            time.strftime("%H:%M:%S"), self.reads, self.reads / elapsed, self.bytes / elapsed / 1e6,
+            self.seconds['decompress'], self.seconds['classify'], self.seconds['compress']))
+        top = self.unmatched.top(self.top)
+        if top:
+            sys.stderr.write("    top unmatched: " + ", ".join("%s (%d)" % (b.decode('ascii', 'replace'), n) for b, n, e in top) + "\n")
+        sys.stderr.flush()
+
+    def to_dict(self):
+        elapsed = max(self.elapsed(), 1e-9)
+        return {
+            'elapsed_seconds': elapsed,
+            'reads': self.reads,
+            'bytes': self.bytes,
+            'reads_per_second': self.reads / elapsed,
+            'mb_per_second': self.bytes / elapsed / 1e6,
+            'seconds': dict(self.seconds),
+            'top_unmatched': [ { 'barcode': b.decode('ascii', 'replace'), 'count': n, 'max_overcount': e }
+                for b, n, e in self.unmatched.top(self.top) ],
+        }
 
 class Demultiplexer:
     """
     initiate by parsing the samples dictionary and cleaning up old outputs
     """
-    def __init__(self, samplesfile):
+    def __init__(self, samplesfile, compresslevel = 6, buffer_size = 4 << 20, max_open = 256, mismatches = 0, writer_threads = 0, paired = False, report_interval = 30, top = 10, backend = "auto", threads = None):
         self.dict = self.parse_csv(samplesfile)
-        self.clean_output_files(self.dict)
+        self.lookup = self.make_lookup(self.dict, mismatches)
+        self.num_ambiguous = { }
+        self.stats = RunStats(report_interval, top)
         self.num_records_written = { }
         for sample in self.dict.values():
             self.num_records_written[sample] = 0
         self.num_records_written["orphans"] = 0
+        self.backend = backend
+        self.threads = threads
+        # output file names for each sample: R1 and R2 in paired mode
+        ext = ".fq.zst" if backend == "zstd" else ".fq.gz"
+        if paired:
+            self.outfiles = { sample: (sample + "_R1" + ext, sample + "_R2" + ext) for sample in self.num_records_written }
+        else:
+            self.outfiles = { sample: (sample + ext, None) for sample in self.num_records_written }
+        self.clean_output_files(self.outfiles)
         self.total_records_written = 0
+        pool_args = { 'max_open': max_open, 'buffer_size': buffer_size, 'compresslevel': compresslevel, 'backend': backend }
+        if writer_threads > 0:
+            # the files are spread over the writer threads, which share the
+            # compression threads
+            pool_args['threads'] = max(1, (threads or gziptools.default_threads()) // writer_threads)
+            self.writers = fastqtools.ThreadedWriterPool(writer_threads, **pool_args)
+        else:
+            pool_args['threads'] = threads
+            self.writers = fastqtools.WriterPool(**pool_args)
 
     """
     parse CSV into a dictionary
@@ -50,81 +173,170 @@ class Demultiplexer:
         with open(samplesfile) as fh:
             file = csv.reader(fh)
             for row in file:
-                data[row[1]] = row[0]
+                barcode = row[1].strip()
+                # dual index in a third column
+                if len(row) > 2 and row[2].strip():
+                    barcode = barcode + "+" + row[2].strip()
+                # barcodes are compared as bytes, straight from the FASTQ header
+                data[barcode.encode('ascii')] = row[0]
             return(data)
 
+    """
+    build the barcode lookup table: every sequence within `mismatches` of a
+    sample barcode maps to that sample. sequences close to more than one
+    sample map to a tuple of the candidate samples instead. raises ValueError
+    if a sample's own barcode is within reach of another sample.
+    """
+    def make_lookup(self, barcodes, mismatches):
+        lookup = { }
+        for barcode, sample in barcodes.items():
+            for seq in fastqtools.hamming_neighbours(barcode, mismatches):
+                other = lookup.get(seq)
+                if other is None:
+                    lookup[seq] = sample
+                elif other != sample:
+                    candidates = set(other) if isinstance(other, tuple) else { other }
+                    candidates.add(sample)
+                    lookup[seq] = tuple(sorted(candidates))
+        for barcode, sample in barcodes.items():
+            if lookup[barcode] != sample:
+                raise ValueError("Barcodes of samples " + ", ".join(lookup[barcode]) +
+                    " are within " + str(mismatches) + " mismatches of each other")
+        return(lookup)
+
     """
     remove old output files, if they exist
     """
-    def clean_output_files(self, dict):
-        for sample in dict.values():
-            try:
-                os.remove(sample + ".fq.gz")
-            except:
-                pass # I don't care, if there is a problem it will show up again when writing to the file
-        try:
-            os.remove("orphans.fq.gz")
-        except:
-            pass
-
-    """
-    write one fastq record to an output file. the file name is constructed from
-    the sample name + ".fq.gz" (gzipped).
-    """
-    def write_record(self, data, sample):
-        # die if dataset incomplete
-        if len(data) != 4:
-            raise ValueError("Incomplete record with " + len(data) + "lines, expected 4 lines")
-        # write record to output file
-        outfile = sample + ".fq.gz"
-        with gzip.open(outfile, 'a') as ofh:
-            output_line = "\n".join(data) + "\n"
-            ofh.write(output_line.encode('ascii'))
-            ofh.close()
+    def clean_output_files(self, outfiles):
+        for files in outfiles.values():
+            for f in files:
+                if f is None:
+                    continue
+                try:
+                    os.remove(f)
+                except:
+                    pass # I don't care, if there is a problem it will show up again when writing to the file
+
+    """
+    write the records of one block that belong to one sample (bytes, complete
+    records) to the sample's output file(s). the file name is constructed from
+    the sample name + ".fq.gz" (gzipped), or + "_R1.fq.gz" and "_R2.fq.gz" in
+    paired mode (.fq.zst with the zstd backend). records are buffered by the writer pool and written in large
+    blocks.
+    """
+    def write_records(self, data, mate_data, n, sample):
+        outfile, mate_outfile = self.outfiles[sample]
+        self.writers.write(outfile, data)
+        if mate_data is not None:
+            self.writers.write(mate_outfile, mate_data)
         # collect counts for report
-        self.num_records_written[sample] += 1
-        self.total_records_written += 1
+        self.num_records_written[sample] += n
+        self.total_records_written += n
 
     """
-    demultiplex: split the header to extract the barcode,
-    name the output file according to the barcode dictionary,
-    and write the records to the output files
+    write the result of classify_chunk() for one block
     """
-    def demultiplex(self, fastqfile):
-        # open FASTQ file
-        if fastqfile.endswith(".fastq.gz") or fastqfile.endswith(".fq.gz"):
-            fh = gzip.open(fastqfile, 'rb')
-        elif fastqfile.endswith(".fastq") or fastqfile.endswith(".fq"):
-            fh = open(fastqfile, 'rb')
-        else:
-            sys.exit("Unknown file format: " + fastqfile + ". I can read .fastq, .fq, fastq.gz and .fq.gz")
-
-        # do the parsing and sorting into files
-        data = [ ]
-        for line in fh:
-            str_line = line.decode('ascii').strip()
-            # header lines -- this assumes that qual lines do not start with @
-            # for additional certainty, a counter or enumerate() could be used
-            if str_line.startswith("@"):
-                hdr_parts = str_line.split(":")
-                barcode = hdr_parts[-1]
-                # set the sample name according to the barcode dictionary
-                # or "orphans" if absent
-                if not barcode in self.dict.keys():
-                    sample = "orphans"
-                else:
-                    sample = self.dict[barcode]
-                # write record unless first line (empty data)
-                if len(data) != 0:
-                    self.write_record(data, sample)
-                # make new record list
-                data = [ str_line ]
-            # collect data until next header line
-            else:
-                data.append(str_line)
-        # write the last record
-        self.write_record(data, sample)
-        fh.close()
+    def write_block(self, by_sample, ambiguous, unmatched):
+        for sample, (n, data, mate_data) in by_sample.items():
+            self.write_records(data, mate_data, n, sample)
+        for samples, n in ambiguous.items():
+            self.num_ambiguous[samples] = self.num_ambiguous.get(samples, 0) + n
+
+    """
+    write one classified block and update the statistics: size of the input
+    block, and the time it took to read and to classify it
+    """
+    def add_block(self, result, nbytes, read_seconds, classify_seconds):
+        self.write_block(*result)
+        reads = sum(n for n, data, mate_data in result[0].values())
+        self.stats.add(reads, nbytes, read_seconds, classify_seconds, result[2])
+        self.stats.maybe_report(self.writers.seconds)
+
+    """
+    demultiplex: extract the barcode from the header, name the output file
+    according to the barcode dictionary, and write the records to the output
+    files. records are read as raw bytes and copied to the output unchanged.
+    in paired mode, `mate` is the R2 file that goes with `fastqfile`.
+    """
+    def demultiplex(self, fastqfile, jobs = 1, mate = None):
+        # check FASTQ file names
+        for f in (fastqfile, mate):
+            if f is not None and not f.endswith((".fastq.gz", ".fq.gz", ".fastq.zst", ".fq.zst", ".fastq", ".fq")):
+                sys.exit("Unknown file format: " + f + ". I can read .fastq, .fq, .fastq.gz, .fq.gz, .fastq.zst and .fq.zst")
+        if jobs > 1:
+            return self.demultiplex_parallel(fastqfile, jobs, mate)
+
+        # do the parsing and sorting into files, one block of records at a time
+        blocks = read_blocks(fastqfile, mate, self.backend, self.threads)
+        while True:
+            t0 = time.perf_counter()
+            block = next(blocks, None)
+            t1 = time.perf_counter()
+            if block is None:
+                break
+            result = classify_chunk(block[0], self.lookup, block[1])
+            self.add_block(result, block_size(*block), t1 - t0, time.perf_counter() - t1)
+
+    """
+    demultiplex with a reader process, `jobs` classifier processes and the
+    writer threads. blocks are numbered by the reader and written in that
+    order, whatever order the workers finish them in.
+    """
+    def demultiplex_parallel(self, fastqfile, jobs, mate = None):
+        in_q  = multiprocessing.Queue(maxsize = 2 * jobs)
+        out_q = multiprocessing.Queue(maxsize = 2 * jobs)
+        procs = [ multiprocessing.Process(target = read_chunks, args = (fastqfile, mate, in_q, out_q, jobs, self.backend, self.threads)) ]
+        procs.extend(multiprocessing.Process(target = classify_worker, args = (self.lookup, in_q, out_q)) for i in range(jobs))
+        for p in procs:
+            p.start()
+        # a process that is killed (e.g. by the OOM killer) sends nothing and
+        # may leave a message half written, so out_q.get() would wait forever:
+        # a watchdog thread interrupts the main thread instead
+        finished = threading.Event()
+        died = [ ]
+        main_thread = threading.get_ident()
+        def watch():
+            while not finished.wait(1):
+                for p in procs:
+                    if p.exitcode:
+                        died.append(p)
+                        signal.pthread_kill(main_thread, signal.SIGINT)
+                        return
+        threading.Thread(target = watch, daemon = True).start()
+        try:
+            pending = { }     # blocks that arrived before their turn
+            next_block = 0
+            running = jobs
+            while running:
+                item = out_q.get()
+                if item is None: # a worker is done
+                    running -= 1
+                    continue
+                if item[0] < 0:
+                    sys.exit("Fatal: " + fastqfile + ": " + item[1])
+                pending[item[0]] = item[1:]
+                while next_block in pending:
+                    self.add_block(*pending.pop(next_block))
+                    next_block += 1
+            if pending:
+                sys.exit("Fatal: " + fastqfile + ": missing block " + str(next_block))
+        except KeyboardInterrupt:
+            if not died:
+                raise
+            sys.exit("Fatal: " + fastqfile + ": " + ("reader" if died[0] is procs[0] else "classifier") + " process died with exit code " + str(died[0].exitcode))
+        finally:
+            finished.set()
+            for p in procs:
+                if p.is_alive() and sys.exc_info()[0] is not None:
+                    p.terminate()
+                p.join()
+
+    """
+    flush all buffered output and close the output files
+    """
+    def close(self):
+        self.writers.close()
+        self.stats.seconds['compress'] = self.writers.seconds
 
     """
     write a report with the collected counts
@@ -132,15 +344,189 @@ class Demultiplexer:
     def print_report(self):
         for sample in self.num_records_written:
             print(sample + ": " + str(self.num_records_written[sample]) + " records")
+        for samples in sorted(self.num_ambiguous):
+            print("ambiguous (" + "/".join(samples) + "): " + str(self.num_ambiguous[samples]) + " records (in orphans)")
         print("Total: " + str(self.total_records_written) + " records")
+        self.stats.report(self.writers.seconds)
+
+    """
+    write all counts and statistics to a JSON file
+    """
+    def write_json_report(self, path):
+        report = {
+            'samples': self.num_records_written,
+            'total': self.total_records_written,
+            'ambiguous': [ { 'samples': list(s), 'records': n } for s, n in sorted(self.num_ambiguous.items()) ],
+        }
+        report.update(self.stats.to_dict())
+        with open(path, "w") as fh:
+            json.dump(report, fh, indent = 2)
 
-def main(sample_csv, fastq_files):
-    dm = Demultiplexer(sample_csv) # argument: the sample CSV
-    for fastq in fastq_files: # argument: the FASTQ files
-	dm.demultiplex(fastq)
+"""
+read a FASTQ file, or an R1/R2 pair in lockstep, as blocks of complete
+records. yields (block, mate block), the mate block is None for single files
+"""
+def read_blocks(fastqfile, mate = None, backend = "auto", threads = None):
+    with fastqtools.open_fastq(fastqfile, backend, threads) as fh:
+        reader = fastqtools.FastqReader(fh)
+        if mate is None:
+            for chunk in reader.chunks():
+                yield chunk, None
+            return
+        with fastqtools.open_fastq(mate, backend, threads) as mate_fh:
+            for chunk, mate_chunk in fastqtools.paired_chunks(reader, fastqtools.FastqReader(mate_fh)):
+                yield chunk, mate_chunk
+
+"""
+size of a block (and its mate block) in bytes
+"""
+def block_size(chunk, mate_chunk = None):
+    return len(chunk) + (len(mate_chunk) if mate_chunk is not None else 0)
+
+"""
+sort the records of one block of complete records by sample. in paired mode,
+`mate_chunk` holds the R2 records for the R1 records in `chunk`; each pair is
+assigned by the barcode in the R1 header. returns a dictionary sample ->
+(number of records, R1 records as one bytes object, R2 records or None), a
+dictionary with the number of ambiguous records per tuple of candidate
+samples, and a dictionary with the number of records per barcode that went to
+orphans
+"""
+def classify_chunk(chunk, lookup, mate_chunk = None):
+    if mate_chunk is not None:
+        return classify_pairs(chunk, mate_chunk, lookup)
+    by_sample = { }
+    ambiguous = { }
+    unmatched = { }
+    for header, record in fastqtools.records(chunk):
+        # the barcode is the last colon-separated field of the header
+        barcode = header[header.rfind(b":") + 1:].rstrip()
+        # set the sample name according to the barcode lookup table
+        # or "orphans" if absent or ambiguous
+        sample = lookup.get(barcode, "orphans")
+        if sample.__class__ is tuple:
+            ambiguous[sample] = ambiguous.get(sample, 0) + 1
+            sample = "orphans"
+        if sample == "orphans":
+            unmatched[barcode] = unmatched.get(barcode, 0) + 1
+        if sample in by_sample:
+            by_sample[sample].append(record)
+        else:
+            by_sample[sample] = [ record ]
+    return { s: (len(r), b"".join(r), None) for s, r in by_sample.items() }, ambiguous, unmatched
+
+def classify_pairs(chunk, mate_chunk, lookup):
+    by_sample = { }
+    ambiguous = { }
+    unmatched = { }
+    for (header, record), (mate_header, mate_record) in zip(fastqtools.records(chunk), fastqtools.records(mate_chunk)):
+        if fastqtools.read_name(header) != fastqtools.read_name(mate_header):
+            raise ValueError("R1 and R2 out of sync at " + header.decode('ascii', 'replace'))
+        barcode = header[header.rfind(b":") + 1:].rstrip()
+        sample = lookup.get(barcode, "orphans")
+        if sample.__class__ is tuple:
+            ambiguous[sample] = ambiguous.get(sample, 0) + 1
+            sample = "orphans"
+        if sample == "orphans":
+            unmatched[barcode] = unmatched.get(barcode, 0) + 1
+        if sample in by_sample:
+            by_sample[sample][0].append(record)
+            by_sample[sample][1].append(mate_record)
+        else:
+            by_sample[sample] = ([ record ], [ mate_record ])
+    return { s: (len(r1), b"".join(r1), b"".join(r2)) for s, (r1, r2) in by_sample.items() }, ambiguous, unmatched
+
+"""
+reader process: decompress the input and cut it into numbered blocks of
+complete records. each block is passed on with the time it took to read it.
+errors are passed on to the main process as (-1, message)
+"""
+def read_chunks(fastqfile, mate, in_q, out_q, jobs, backend = "auto", threads = None):
+    try:
+        blocks = read_blocks(fastqfile, mate, backend, threads)
+        i = 0
+        while True:
+            t0 = time.perf_counter()
+            block = next(blocks, None)
+            if block is None:
+                break
+            in_q.put((i, block[0], block[1], time.perf_counter() - t0))
+            i += 1
+    except Exception as e:
+        out_q.put((-1, str(e)))
+    finally:
+        for i in range(jobs):
+            in_q.put(None)
+
+"""
+worker process: classify blocks until the reader is done. results are passed
+on as (block number, result, block size, read time, classification time).
+errors are passed on as (-1, message); the final None is always sent, so the
+main process does not wait forever
+"""
+def classify_worker(lookup, in_q, out_q):
+    try:
+        while True:
+            item = in_q.get()
+            if item is None:
+                break
+            i, chunk, mate_chunk, read_seconds = item
+            t0 = time.perf_counter()
+            result = classify_chunk(chunk, lookup, mate_chunk)
+            out_q.put((i, result, block_size(chunk, mate_chunk), read_seconds, time.perf_counter() - t0))
+    except ValueError as e:
+        out_q.put((-1, str(e)))
+    except Exception as e:
+        out_q.put((-1, type(e).__name__ + ": " + str(e)))
+    finally:
+        out_q.put(None)
+
+def main(args):
+    try:
+        dm = Demultiplexer(args.samples_csv, # argument: the sample CSV
+            compresslevel = args.compresslevel,
+            buffer_size = int(args.buffer_size * (1 << 20)),
+            max_open = args.max_open_files,
+            mismatches = args.mismatches,
+            writer_threads = args.writer_threads if args.writer_threads is not None else (args.jobs if args.jobs > 1 else 0),
+            paired = args.paired,
+            report_interval = args.report_interval,
+            top = args.top_unmatched,
+            backend = args.backend,
+            threads = args.threads)
+    except ValueError as e:
+        sys.exit("Fatal: " + str(e))
+    # argument: the FASTQ files, taken two at a time in paired mode
+    if args.paired:
+        if len(args.fastq_files) % 2:
+            sys.exit("Fatal: --paired needs an even number of FASTQ files (R1 R2 [R1 R2 ...])")
+        inputs = list(zip(args.fastq_files[0::2], args.fastq_files[1::2]))
+    else:
+        inputs = [ (f, None) for f in args.fastq_files ]
+    for fastq, mate in inputs:
+        try:
+            dm.demultiplex(fastq, args.jobs, mate)
+        except ValueError as e:
+            sys.exit("Fatal: " + fastq + ": " + str(e))
+    dm.close()
     dm.print_report()
+    if args.json_report:
+        dm.write_json_report(args.json_report)
 
 if __name__ == "__main__":
-    if len(sys.argv) <= 3:
-        sys.exit("I need two arguments: (1) the samples CSV file; and (2) the FASTQ file(s)")
-    main(sys.argv[1], sys.argv[2:])
+    parser = argparse.ArgumentParser(description = "Demultiplex FASTQ files by barcode")
+    parser.add_argument("samples_csv", help = "CSV file with sample name and barcode per line")
+    parser.add_argument("fastq_files", nargs = "+", help = "FASTQ file(s), optionally gzip compressed")
+    parser.add_argument("--paired", action = "store_true", help = "paired-end mode: FASTQ files are R1/R2 pairs, written to <sample>_R1.fq.gz and <sample>_R2.fq.gz")
+    parser.add_argument("--mismatches", type = int, default = 0, help = "number of mismatches allowed in the barcode (default: 0)")
+    parser.add_argument("--jobs", type = int, default = 1, help = "number of classifier processes; more than 1 enables the reader/worker/writer pipeline (default: 1)")
+    parser.add_argument("--writer-threads", type = int, default = None, help = "number of output compression threads (default: same as --jobs, none in serial mode)")
+    parser.add_argument("--report-interval", type = float, default = 30, help = "seconds between progress reports on stderr, 0 to disable (default: 30)")
+    parser.add_argument("--top-unmatched", type = int, default = 10, help = "number of most frequent unmatched barcodes to report (default: 10)")
+    parser.add_argument("--json-report", type = str, default = None, help = "write counts and statistics to this JSON file at the end")
+    parser.add_argument("--compresslevel", type = int, default = 6, help = "gzip compression level for the output files (1-9, default: 6)")
+    parser.add_argument("--backend", choices = gziptools.BACKENDS, default = "auto", help = "how to read and write compressed files (default: auto, see gziptools.py)")
+    parser.add_argument("--threads", type = int, default = None, help = "number of threads for BGZF, pigz and zstd (de)compression (default: number of CPUs)")
+    parser.add_argument("--buffer-size", type = float, default = 4, help = "output buffer size per sample in MB (default: 4)")
+    parser.add_argument("--max-open-files", type = int, default = 256, help = "maximum number of output files open at the same time (default: 256)")
+    main(parser.parse_args())
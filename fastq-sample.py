@@ -2,16 +2,40 @@
 
 """
 Randomly downsample a read library to a fraction of its original size
-Input must be gzipped or bzipped FASTQ format
+Input must be gzipped, bzipped or zstd compressed FASTQ format
+
+Instead of rolling a random number for every read, the number of reads
+to skip before the next selected one is drawn from a geometric
+distribution, and the reads in between are skipped without being parsed.
+Every read is still kept with probability --percent, independently of
+the others, so the sample has the same properties as before; a given
+--seed is reproducible, but selects different reads than older versions.
+
+With --sample-size N, exactly N reads are drawn uniformly from the whole
+file in one pass (reservoir sampling), and written in their original
+order. The sampled records are kept in memory as raw bytes, so this needs
+about N times the record size plus some 50 bytes per record.
+
+With --in2/--out2, the R2 file of a paired library is sampled along with
+the R1 file, keeping the same reads in both.
+
+--backend selects how gzip files are read and written (see gziptools.py).
+The default reads BGZF input and writes BGZF output (which is valid gzip)
+in --threads parallel threads, and reads other gzip input through pigz if
+it is installed. Output files ending in .zst are written as zstd; with
+--backend zstd, the output file names must end in .zst.
 """
 
 from __future__ import division
 import sys
 import time
+import math
+import array
 import random
-import gzip
-import bz2
 import argparse
+import itertools
+import fastqtools
+import gziptools
 
 if sys.version_info[0] != 3 or sys.version_info[1] < 3:
     sys.exit("Version mismatch: Python 3.3 or later required. You have %d.%d" % ( sys.version_info[0], sys.version_info[1] ) )
@@ -20,54 +44,169 @@ argparser = argparse.ArgumentParser()
 argparser.add_argument("infile", type=str)
 argparser.add_argument("outfile", type=str)
 argparser.add_argument("-p", "--percent",     type=float, default=0.01, help="Percent of records to be sampled (fraction of 1; default: 0.1)")
+argparser.add_argument("-k", "--sample-size", type=int, help="Sample exactly this many records (or all, if there are fewer), uniformly from the whole file; overrides --percent")
 argparser.add_argument("-s", "--seed",        type=int, help="Set the random seed (integer)")
-argparser.add_argument("-n", "--max-records", type=int, help="Maximum number of records to be sampled")
+argparser.add_argument("-n", "--max-records", type=int, help="Maximum number of records to be sampled (stops early; use --sample-size for an unbiased sample of fixed size)")
+argparser.add_argument("--in2",  type=str, help="R2 file of a paired library; the same records are sampled from both files")
+argparser.add_argument("--out2", type=str, help="Output file for the sampled R2 records")
+argparser.add_argument("--backend", choices=gziptools.BACKENDS, default="auto", help="How to read and write compressed files (default: auto, see gziptools.py)")
+argparser.add_argument("--threads", type=int, help="Number of threads for BGZF, pigz and zstd (de)compression (default: number of CPUs)")
 args = argparser.parse_args()
 
 percent = float(args.percent)
 
-if not args.infile.endswith(".gz") and not args.infile.endswith(".bz2"):
-    sys.exit("error: input file must be gzipped or bzipped fastq (ending in .gz or .bz2)")
+for f in (args.infile, args.in2):
+    if f and not f.endswith((".gz", ".bz2", ".zst")):
+        sys.exit("error: input file must be gzipped, bzipped or zstd compressed fastq (ending in .gz, .bz2 or .zst)")
+for f in (args.outfile, args.out2):
+    if f and args.backend == "zstd" and not f.endswith(".zst"):
+        sys.exit("error: --backend zstd writes zstd, the output file name must end in .zst")
+if bool(args.in2) != bool(args.out2):
+    sys.exit("error: --in2 and --out2 must be given together")
+if args.sample_size is not None and args.sample_size < 0:
+    sys.exit("error: --sample-size must not be negative")
 
 seed        = args.seed if args.seed else int(time.time())
 max_records = args.max_records if args.max_records else float("inf")
 
 print("input file: %s" % args.infile)
 print("output file: %s" % args.outfile)
-print("sampling %.01f percent of the reads" % float(percent * 100))
+if args.in2:
+    print("mate input file: %s" % args.in2)
+    print("mate output file: %s" % args.out2)
+if args.sample_size is not None:
+    print("sampling %d reads" % args.sample_size)
+else:
+    print("sampling %.01f percent of the reads" % float(percent * 100))
 
 random.seed(seed)
 
-INPUT = ""
-
-if args.infile.endswith(".gz"):
+def open_input(path):
     try:
-        # io.TextIOWrapper required for backwards compatibility with Python 3.2
-        INPUT = gzip.open(args.infile, 'rt')
+        return fastqtools.open_fastq(path, args.backend, args.threads)
     except Exception as e:
-        sys.exit("Fatal: could not open " + str(args.infile) + ": %s" % e)
+        sys.exit("Fatal: could not open " + str(path) + ": %s" % e)
 
-elif args.infile.endswith(".bz2"):
+def open_output(path):
     try:
-        # io.TextIOWrapper required for backwards compatibility with Python 3.2
-        INPUT = bz2.open(args.infile, 'rt')
+        return gziptools.open_output(path, 'wb', args.backend, threads=args.threads)
     except Exception as e:
-        sys.exit("Fatal: could not open " + str(args.infile) + ": %s" % e)
-
-n_written = 0
-
-with gzip.open(args.outfile, 'wt') as OUTPUT:
-    for line1 in INPUT:
-        line2 = next(INPUT)
-        line3 = next(INPUT)
-        line4 = next(INPUT)
-        if random.random() <= percent:
-            OUTPUT.write(str(line1))
-            OUTPUT.write(str(line2))
-            OUTPUT.write(str(line3))
-            OUTPUT.write(str(line4))
-            n_written += 1
-            if n_written >= max_records: break
-                
+        sys.exit("Fatal: could not open " + str(path) + ": %s" % e)
+
+def gaps(p):
+    """
+    Yield the number of records to skip before each selected record, i.e.
+    the number of failures before the next success in Bernoulli trials
+    with probability p.
+    """
+    if p >= 1:
+        return itertools.repeat(0)
+    if p <= 0:
+        return iter(())
+    log_q = math.log(1.0 - p)
+    # 1 - random() is in (0, 1], so the logarithm is defined
+    return (int(math.log(1.0 - random.random()) / log_q) for _ in itertools.count())
+
+class Sampler:
+    """
+    Skip and read records in lockstep from one FASTQ file or from the R1 and
+    R2 files of a paired library, so both mates always have the same record
+    index.
+    """
+    def __init__(self, readers):
+        self.readers = readers
+        self.index = 0 # index of the next record in the file(s)
+
+    def skip(self, n):
+        """
+        Skip n records; returns False if the file ends first.
+        """
+        skipped = [ r.skip(n) for r in self.readers ]
+        if len(set(skipped)) > 1:
+            sys.exit("Fatal: R1 and R2 files have different numbers of records")
+        self.index += skipped[0]
+        return skipped[0] == n
+
+    def next(self):
+        """
+        Return the raw bytes of the next record in each file, or None at the
+        end of the file(s).
+        """
+        recs = [ r.next_record() for r in self.readers ]
+        if recs[0] is None or recs[-1] is None:
+            if any(rec is not None for rec in recs):
+                sys.exit("Fatal: R1 and R2 files have different numbers of records")
+            return None
+        if len(recs) > 1 and fastqtools.read_name(recs[0][0]) != fastqtools.read_name(recs[1][0]):
+            sys.exit("Fatal: R1 and R2 out of sync at " + recs[0][0].decode('ascii', 'replace'))
+        self.index += 1
+        return [ rec[1] for rec in recs ]
+
+def sample_fraction(sampler, outputs, p):
+    n = 0
+    for gap in gaps(p):
+        if n >= max_records or not sampler.skip(gap):
+            break
+        recs = sampler.next()
+        if recs is None:
+            break
+        for out, rec in zip(outputs, recs):
+            out.write(rec)
+        n += 1
+    return n
+
+def sample_reservoir(sampler, outputs, k):
+    """
+    Draw exactly k records (or all of them, if there are fewer) with
+    Algorithm L (Li, 1994): after the reservoir is full, the number of
+    records to skip before the next replacement is drawn directly, so the
+    records in between are only counted, not parsed. The reservoir holds the
+    raw record bytes and their index in the file; the sample is written in
+    file order.
+    """
+    index = array.array('q')
+    reservoir = [ [ ] for _ in outputs ]
+    while len(index) < k:
+        recs = sampler.next()
+        if recs is None:
+            break
+        index.append(sampler.index - 1)
+        for res, rec in zip(reservoir, recs):
+            res.append(rec)
+    if k and len(index) == k:
+        w = math.exp(math.log(1.0 - random.random()) / k)
+        while w < 1.0:
+            gap = int(math.log(1.0 - random.random()) / math.log(1.0 - w))
+            if not sampler.skip(gap):
+                break
+            recs = sampler.next()
+            if recs is None:
+                break
+            slot = random.randrange(k)
+            index[slot] = sampler.index - 1
+            for res, rec in zip(reservoir, recs):
+                res[slot] = rec
+            w *= math.exp(math.log(1.0 - random.random()) / k)
+    order = sorted(range(len(index)), key = index.__getitem__)
+    for out, res in zip(outputs, reservoir):
+        for i in order:
+            out.write(res[i])
+    return len(index)
+
+inputs  = [ open_input(args.infile) ] + ([ open_input(args.in2) ] if args.in2 else [ ])
+outputs = [ open_output(args.outfile) ] + ([ open_output(args.out2) ] if args.out2 else [ ])
+sampler = Sampler([ fastqtools.FastqReader(f) for f in inputs ])
+
+# records are read and written as raw bytes, four lines at a time
+try:
+    if args.sample_size is not None:
+        n_written = sample_reservoir(sampler, outputs, args.sample_size)
+    else:
+        n_written = sample_fraction(sampler, outputs, percent)
+except ValueError as e:
+    sys.exit("Fatal: %s" % e)
+finally:
+    for out in outputs:
+        out.close()
 
 print("Wrote %d records" % n_written)
@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+
+"""
+Shared FASTQ helpers for fastq-demultiplex.py and fastq-sample.py.
+"""
+
+import itertools
+import threading
+import queue
+import time
+import heapq
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import gziptools
+
+def open_fastq(path, backend = "auto", threads = None):
+    """
+    Open a FASTQ file for reading in binary mode. Files ending in .gz, .bz2
+    or .zst are decompressed on the fly, with the given gziptools backend.
+    """
+    return gziptools.open_input(path, backend, threads)
+
+class FastqReader:
+    """
+    Read 4-line FASTQ records from a binary handle in large chunks. Iterating
+    yields (header, record) pairs of bytes: the header line without the
+    leading '@' and the line break, and the complete record with all four
+    lines and line breaks, ready to be written out again. Nothing is decoded,
+    and record boundaries are found by counting lines, so quality lines
+    starting with '@' are no problem.
+    """
+    def __init__(self, handle, chunk_size = 4 << 20):
+        self.handle = handle
+        self.chunk_size = chunk_size
+        self.buffer = b""   # data read ahead by take(), skip() and next_record()
+        self.pos = 0        # current position in the buffer
+        self.line_length = None # average line length, for skip()
+
+    def __iter__(self):
+        for chunk in self.chunks():
+            for rec in records(chunk):
+                yield rec
+
+    def chunks(self):
+        """
+        Yield blocks of roughly chunk_size bytes that contain only complete
+        records. The cut points are found by counting line breaks, so this is
+        cheap enough to run in a separate reader process.
+        """
+        read = self.handle.read
+        rest = self.buffer[self.pos:]
+        self.buffer = b""
+        self.pos = 0
+        while True:
+            data = read(self.chunk_size)
+            if not data:
+                break
+            buf = rest + data
+            # lines of an incomplete record at the end of the block
+            extra = buf.count(b"\n") % 4
+            end = buf.rfind(b"\n")
+            for i in range(extra):
+                if end < 0:
+                    break
+                end = buf.rfind(b"\n", 0, end)
+            if end >= 0:
+                yield buf[:end+1]
+            rest = buf[end+1:]
+        if rest:
+            lines = rest.count(b"\n")
+            if lines == 3 and not rest.endswith(b"\n"):
+                # last line without line break
+                yield rest + b"\n"
+            else:
+                raise ValueError("Truncated FASTQ record at end of file")
+
+    def take(self, n):
+        """
+        Return a block with the next n complete records (fewer at the end of
+        the file, b"" when there are none left).
+        """
+        lines = 4 * n
+        if self.pos:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        pieces = [ self.buffer ]
+        have = self.buffer.count(b"\n")
+        while have < lines:
+            data = self.handle.read(self.chunk_size)
+            if not data:
+                break
+            have += data.count(b"\n")
+            pieces.append(data)
+        buf = b"".join(pieces)
+        if have < lines:
+            # end of file
+            if have % 4 == 3 and not buf.endswith(b"\n"):
+                buf += b"\n" # last line without line break
+                have += 1
+            if have % 4:
+                raise ValueError("Truncated FASTQ record at end of file")
+            self.buffer = b""
+            return buf
+        # cut after the lines-th line break: binary search with bytes.count
+        lo, hi = 0, len(buf)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if buf.count(b"\n", 0, mid) >= lines:
+                hi = mid
+            else:
+                lo = mid + 1
+        self.buffer = buf[lo:]
+        return buf[:lo]
+
+    def fill(self):
+        """
+        Read the next chunk into the buffer, keeping the unread data. Returns
+        False at the end of the file.
+        """
+        data = self.handle.read(self.chunk_size)
+        if not data:
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        self.line_length = len(data) / max(1, data.count(b"\n"))
+        return True
+
+    def next_record(self):
+        """
+        Return the next record as a (header, record) pair, or None at the end
+        of the file.
+        """
+        while True:
+            buf = self.buffer
+            pos = self.pos
+            e1 = buf.find(b"\n", pos)
+            e2 = buf.find(b"\n", e1 + 1) if e1 >= 0 else -1
+            e3 = buf.find(b"\n", e2 + 1) if e2 >= 0 else -1
+            e4 = buf.find(b"\n", e3 + 1) if e3 >= 0 else -1
+            if e4 >= 0:
+                break
+            if not self.fill():
+                if pos >= len(buf):
+                    return None
+                if e3 >= 0 and buf.count(b"\n", pos) == 3:
+                    self.buffer += b"\n" # last line without line break
+                    continue
+                raise ValueError("Truncated FASTQ record at end of file")
+        if buf[pos] != 64 or buf[e2+1] != 43: # '@' and '+'
+            raise ValueError("Invalid FASTQ record: " + buf[pos:e1].decode('ascii', 'replace'))
+        self.pos = e4 + 1
+        return buf[pos+1:e1], buf[pos:e4+1]
+
+    def skip(self, n):
+        """
+        Skip the next n records without parsing them. Line breaks are counted
+        in spans that, judging by the average line length, stay just short of
+        the target; only the last few lines are found one by one. Returns the
+        number of records skipped (fewer than n at the end of the file).
+        """
+        lines = 4 * n
+        while lines:
+            buf = self.buffer
+            if lines > 64 and self.line_length:
+                end = self.pos + max(1, int((lines - 32) * self.line_length))
+                if end >= len(buf):
+                    # stop after the last complete line, keep the rest
+                    end = buf.rfind(b"\n", self.pos) + 1 or self.pos
+                counted = buf.count(b"\n", self.pos, end)
+                if counted >= lines:
+                    # shorter lines than expected, try a smaller span
+                    self.line_length /= 2
+                    continue
+                lines -= counted
+                if end > self.pos:
+                    self.pos = end
+                    continue
+            else:
+                e = buf.find(b"\n", self.pos)
+                if e >= 0:
+                    lines -= 1
+                    self.pos = e + 1
+                    continue
+            # buffer used up
+            if not self.fill():
+                if self.pos < len(self.buffer):
+                    lines -= 1 # last line without line break
+                    self.pos = len(self.buffer)
+                break
+        return n - (lines + 3) // 4
+
+def paired_chunks(reader1, reader2):
+    """
+    Yield (chunk1, chunk2) pairs of blocks with the same number of records
+    from the R1 and R2 readers, for processing read pairs in lockstep.
+    """
+    for chunk1 in reader1.chunks():
+        n = chunk1.count(b"\n") // 4
+        chunk2 = reader2.take(n)
+        if chunk2.count(b"\n") // 4 != n:
+            raise ValueError("R2 file has fewer records than R1 file")
+        yield chunk1, chunk2
+    if reader2.take(1):
+        raise ValueError("R2 file has more records than R1 file")
+
+def read_name(header):
+    """
+    Read name from a header line (bytes): the first word, without a /1 or /2
+    mate suffix.
+    """
+    name = header.split(None, 1)[0] if header else header
+    if name[-2:] in (b"/1", b"/2"):
+        return name[:-2]
+    return name
+
+def records(buf):
+    """
+    Yield (header, record) pairs from a block of complete FASTQ records, as
+    produced by FastqReader.chunks().
+    """
+    pos = 0
+    size = len(buf)
+    while pos < size:
+        # end of the four lines of the next record
+        e1 = buf.find(b"\n", pos)
+        e2 = buf.find(b"\n", e1 + 1)
+        e3 = buf.find(b"\n", e2 + 1)
+        e4 = buf.find(b"\n", e3 + 1)
+        if e1 < 0 or e2 < 0 or e3 < 0 or e4 < 0:
+            raise ValueError("Truncated FASTQ record")
+        if buf[pos] != 64 or buf[e2+1] != 43: # '@' and '+'
+            raise ValueError("Invalid FASTQ record: " + buf[pos:e1].decode('ascii', 'replace'))
+        yield buf[pos+1:e1], buf[pos:e4+1]
+        pos = e4 + 1
+
+def hamming_neighbours(seq, k, alphabet = b"ACGTN"):
+    """
+    Return the set of all sequences (bytes) within Hamming distance k of
+    `seq`, including `seq` itself. Dual indices ("i7+i5") are varied
+    separately, with up to k mismatches in each index.
+    """
+    if b"+" in seq:
+        parts = [ hamming_neighbours(part, k, alphabet) for part in seq.split(b"+") ]
+        return { b"+".join(combination) for combination in itertools.product(*parts) }
+    neighbours = { seq }
+    for d in range(1, k + 1):
+        for positions in itertools.combinations(range(len(seq)), d):
+            choices = [ [ c for c in alphabet if c != seq[p] ] for p in positions ]
+            for subst in itertools.product(*choices):
+                n = bytearray(seq)
+                for p, c in zip(positions, subst):
+                    n[p] = c
+                neighbours.add(bytes(n))
+    return neighbours
+
+class WriterPool:
+    """
+    Write to many gzip'ed output files without opening and closing a file for
+    every record. Data is buffered per file in memory and written out in large
+    blocks. At most `max_open` files are kept open; when more are needed, the
+    least recently used one is closed and later reopened in append mode (which
+    adds a new gzip member, still a valid gzip file). Files are truncated the
+    first time they are opened. `max_buffered` caps the total amount of
+    buffered data; if it is exceeded, the largest buffer is flushed. Files
+    are opened with gziptools.open_output(); with the BGZF backend, one pool
+    of `threads` threads compresses the blocks of all files.
+    """
+    def __init__(self, max_open = 256, buffer_size = 4 << 20, max_buffered = 256 << 20, compresslevel = 6, backend = "gzip", threads = None):
+        self.max_open      = max_open
+        self.buffer_size   = buffer_size
+        self.max_buffered  = max_buffered
+        self.compresslevel = compresslevel
+        self.backend       = backend
+        self.threads       = threads if threads else gziptools.default_threads()
+        self.executor      = None
+        self.buffers  = { }          # path -> list of byte strings
+        self.sizes    = { }          # path -> number of buffered bytes
+        self.total    = 0            # number of buffered bytes, all files
+        self.handles  = OrderedDict() # open handles, least recently used first
+        self.opened   = set()        # paths that have been opened before
+        self.seconds  = 0.0          # time spent compressing and writing, see timed()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, path, data):
+        """
+        Buffer `data` (bytes) for the file `path`.
+        """
+        if path not in self.buffers:
+            self.buffers[path] = [ ]
+            self.sizes[path] = 0
+        self.buffers[path].append(data)
+        self.sizes[path] += len(data)
+        self.total += len(data)
+        if self.sizes[path] >= self.buffer_size:
+            self.flush(path)
+        elif self.total >= self.max_buffered:
+            self.flush(max(self.sizes, key = self.sizes.get))
+
+    def flush(self, path):
+        """
+        Write the buffered data for `path` to the file.
+        """
+        if not self.sizes.get(path):
+            return
+        fh = self.get_handle(path)
+        self.timed(fh, fh.write, b"".join(self.buffers[path]))
+        if isinstance(fh, gziptools.BgzfWriter):
+            self.timed(fh, fh.push) # no buffer per open file, but do not wait for the blocks either
+            for other in self.handles.values():
+                if other is not fh and other.pending:
+                    self.timed(other, other.push) # write out what the other files have compressed meanwhile
+        self.total -= self.sizes[path]
+        self.buffers[path] = [ ]
+        self.sizes[path] = 0
+
+    def timed(self, fh, method, *args):
+        """
+        Call a method of the handle `fh` and add the compression time to
+        `seconds`: the time the call took, or for a BgzfWriter the time its
+        threads spent on the batches written meanwhile, as the call itself
+        mostly just hands the data over.
+        """
+        if isinstance(fh, gziptools.BgzfWriter):
+            before = fh.seconds
+            method(*args)
+            self.seconds += fh.seconds - before
+        else:
+            t0 = time.perf_counter()
+            method(*args)
+            self.seconds += time.perf_counter() - t0
+
+    def get_handle(self, path):
+        fh = self.handles.get(path)
+        if fh is not None:
+            self.handles.move_to_end(path)
+            return fh
+        if len(self.handles) >= self.max_open:
+            lru_path, lru_fh = self.handles.popitem(last = False)
+            self.timed(lru_fh, lru_fh.close)
+        mode = 'ab' if path in self.opened else 'wb'
+        if self.executor is None and self.backend in ("auto", "bgzf"):
+            self.executor = ThreadPoolExecutor(self.threads)
+        fh = gziptools.open_output(path, mode, self.backend, self.compresslevel, self.threads, self.executor)
+        self.opened.add(path)
+        self.handles[path] = fh
+        return fh
+
+    def close(self):
+        """
+        Flush all buffers and close all files. Files that were written to but
+        never flushed are created here, so every used path exists afterwards.
+        """
+        for path in list(self.buffers):
+            self.flush(path)
+            if path not in self.opened:
+                self.get_handle(path)
+        for fh in self.handles.values():
+            self.timed(fh, fh.close)
+        self.handles.clear()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+class ThreadedWriterPool:
+    """
+    Same interface as WriterPool, but compression runs in `writer_threads`
+    writer threads (zlib releases the GIL while compressing). Each output file is
+    assigned to one thread, which owns a WriterPool for its files, so the
+    order of the data written to a file is preserved. The queues to the
+    threads are bounded, so a slow writer blocks the producer.
+    """
+    def __init__(self, writer_threads, queue_size = 64, **pool_args):
+        self.queues = [ queue.Queue(maxsize = queue_size) for i in range(writer_threads) ]
+        self.pools = [ WriterPool(**pool_args) for i in range(writer_threads) ]
+        self.assigned = { }    # path -> thread number
+        self.errors = [ ]
+        self.threads = [ threading.Thread(target = self.run, args = (q, p), daemon = True)
+            for q, p in zip(self.queues, self.pools) ]
+        for t in self.threads:
+            t.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def run(self, q, pool):
+        while True:
+            item = q.get()
+            if item is None:
+                break
+            if self.errors:
+                continue # drain the queue after an error
+            try:
+                pool.write(*item)
+            except Exception as e:
+                self.errors.append(e)
+        try:
+            pool.close()
+        except Exception as e:
+            self.errors.append(e)
+
+    @property
+    def seconds(self):
+        """
+        Time spent compressing and writing, summed over all threads.
+        """
+        return sum(p.seconds for p in self.pools)
+
+    def write(self, path, data):
+        n = self.assigned.get(path)
+        if n is None:
+            n = self.assigned[path] = len(self.assigned) % len(self.queues)
+        self.queues[n].put((path, data))
+
+    def close(self):
+        for q in self.queues:
+            q.put(None)
+        for t in self.threads:
+            t.join()
+        if self.errors:
+            raise self.errors[0]
+
+class SpaceSaving:
+    """
+    Approximate counts of the most frequent items in fixed memory (the
+    Space-Saving algorithm of Metwally et al.). At most `capacity` items are
+    tracked; a new item replaces the one with the smallest count and takes
+    over that count as its possible overcount (error).
+
+    The smallest count is found with a min-heap that holds one (count, item)
+    entry per tracked item. Counts only grow, so an entry may be behind its
+    item's count; increments do not touch the heap, and an outdated entry
+    that comes up as the minimum is pushed again with the current count.
+    An eviction costs O(log capacity) amortised.
+    """
+    def __init__(self, capacity = 1000):
+        self.capacity = capacity
+        self.counts = { }
+        self.errors = { }
+        self.heap = [ ]
+
+    def add(self, item, n = 1):
+        if item in self.counts:
+            self.counts[item] += n
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = n
+            self.errors[item] = 0
+            heapq.heappush(self.heap, (n, item))
+        else:
+            while True:
+                floor, victim = self.heap[0]
+                if self.counts[victim] == floor:
+                    break
+                heapq.heapreplace(self.heap, (self.counts[victim], victim))
+            del self.counts[victim]
+            del self.errors[victim]
+            self.counts[item] = floor + n
+            self.errors[item] = floor
+            heapq.heapreplace(self.heap, (floor + n, item))
+
+    def update(self, counts):
+        """
+        Add a dictionary of item -> count, largest counts first.
+        """
+        for item, n in sorted(counts.items(), key = lambda x: -x[1]):
+            self.add(item, n)
+
+    def top(self, n):
+        """
+        The n most frequent items as (item, count, error) tuples. The true
+        count lies between count - error and count.
+        """
+        items = sorted(self.counts, key = self.counts.get, reverse = True)[:n]
+        return [ (item, self.counts[item], self.errors[item]) for item in items ]
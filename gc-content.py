@@ -4,45 +4,66 @@ from __future__ import division
 import sys
 import os
 import re
+import argparse
 from decimal import *
 import fastaParser
 import fastatools
+import compotools
 
 #print("Call: " + " ".join(sys.argv))
 
-infiles = sys.argv[1:]
+parser = argparse.ArgumentParser()
+parser.add_argument('--outdir', type=str, default='/var/tmp/gc', help="output directory for the per-header CSV files (default: /var/tmp/gc)")
+parser.add_argument('--format', type=str, default='csv', choices=['csv', 'parquet'], help="output format: one CSV file per header (default) or a single Parquet file with all windows")
+parser.add_argument('--output', type=str, default=None, help="Parquet output file (default: gc.parquet in the output directory)")
+parser.add_argument('--mmap', action='store_true', help="memory-map the input files instead of reading whole sequences into memory (memory use independent of the sequence length, needs a regular line length, writes a .fai index next to the input)")
+parser.add_argument('infile', type=str, nargs='+', help="input Fasta file(s)")
+args = parser.parse_args()
+
+infiles = args.infile
 
 class baseCompo:
 	"""Base composition parser"""
-	def __init__(self):
+	def __init__(self, outdir = '/var/tmp/gc', writer = None, mmap = False):
 		self.data = [ ]
 		self.winsize = 50
+		self.outdir = outdir
+		self.writer = writer
+		self.mmap = mmap
 
 	def gc_content(self, inf):
 		self.parse_fasta(inf)
 
 	def parse_fasta(self, f):
-		db = fastatools.FastaFile(f)
+		# with mmap, sequences are lazy views and windows are read one by one
+		db = fastatools.FastaFile(f, mmap=self.mmap)
+		# windows are counted and written chunk by chunk
 		for hdr, seq in db.next_seq():
-			gc_content = self.determine_gc(seq)
-			of = open(os.path.normpath('/var/tmp/gc/' + hdr + '.csv'), 'w')
+			if self.writer is not None:
+				for starts, gc in self.determine_gc(seq):
+					self.writer.write(hdr, starts, gc.reshape(-1, 1))
+				continue
+			of = open(os.path.normpath(os.path.join(self.outdir, hdr + '.csv')), 'w')
 			of.write('pos,gc\n')
-			for l in gc_content:
-				of.write(','.join(str(x) for x in l) + '\n')
+			for starts, gc in self.determine_gc(seq):
+				of.write(''.join([ str(pos) + ',' + str(x) + '\n' for pos, x in zip((starts + 1).tolist(), gc.tolist()) ]))
 			of.close()
-	
+
 	def determine_gc(self, seq):
-		gcs = [ ]
-		for i in range(0, len(seq)-self.winsize, self.winsize):
-			subs = seq[i:i+self.winsize]
-			gs = subs.count('G')
-			cs = subs.count('C')
-			gcs.append([i+1, (gs / self.winsize) + (cs / self.winsize)])
-		return(gcs)
+		for starts, counts in compotools.composition(seq, self.winsize):
+			# G and C fractions added up separately, as before
+			yield starts, counts[:, 0] / self.winsize + counts[:, 1] / self.winsize
 
-compo = baseCompo()
+writer = None
+if args.format == 'parquet':
+	writer = compotools.WindowWriter(args.output if args.output else os.path.join(args.outdir, 'gc.parquet'), [ 'gc' ])
+
+compo = baseCompo(args.outdir, writer, args.mmap)
 
 for inf in infiles:
 	compo.gc_content(inf)
 
+if writer is not None:
+	writer.close()
+
 sys.exit()
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+
+"""
+Compressed input and output for the FASTQ tools. Besides the standard gzip
+module, gzip files can be read and written as BGZF (blocked gzip, as used by
+samtools and htslib), which is still valid gzip but consists of independent
+blocks of at most 64 kB, so the blocks can be compressed and decompressed in
+parallel threads (zlib releases the GIL). The external pigz and zstd
+programs are used through pipes when they are installed.
+
+open_input() and open_output() pick the implementation by file name and
+backend:
+
+    auto   read BGZF in parallel, other gzip files through pigz if it is
+           installed (or the gzip module), write BGZF
+    bgzf   read and write BGZF in parallel threads
+    gzip   the standard gzip module, single-threaded
+    pigz   pipe through pigz
+    zstd   pipe through zstd, which writes zstd and reads zstd and gzip
+
+Files ending in .zst are always read and written through zstd, files ending
+in .bz2 are read with the bz2 module.
+"""
+
+import bz2
+import gzip
+import io
+import os
+import shutil
+import struct
+import subprocess
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+BACKENDS = [ "auto", "bgzf", "gzip", "pigz", "zstd" ]
+
+# uncompressed bytes per BGZF block; small enough that the compressed block
+# fits into 64 kB even for incompressible data (same as htslib)
+BGZF_BLOCK_SIZE = 0xff00
+
+# gzip header with the extra field 'BC' that holds the block size - 1
+BGZF_HEADER = b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00"
+
+# empty block that marks the end of a BGZF file
+BGZF_EOF = BGZF_HEADER + b"\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+
+# number of blocks compressed or decompressed in one task
+BLOCKS_PER_TASK = 64
+
+def default_threads():
+    return os.cpu_count() or 1
+
+def is_block_header(data, pos = 0):
+    """
+    True if a BGZF block header starts at `pos`: a gzip header with only the
+    'BC' extra field (other writers may set MTIME and OS differently).
+    """
+    return data[pos:pos + 4] == BGZF_HEADER[:4] and data[pos + 10:pos + 16] == BGZF_HEADER[10:16]
+
+def is_bgzf(path):
+    """
+    True if the file starts with a BGZF block header.
+    """
+    with open(path, 'rb') as fh:
+        return is_block_header(fh.read(18))
+
+def compress_block(data, compresslevel):
+    """
+    Compress up to BGZF_BLOCK_SIZE bytes into one BGZF block.
+    """
+    c = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    cdata = c.compress(data) + c.flush()
+    return b"".join([ BGZF_HEADER, struct.pack("<H", len(cdata) + 25), cdata,
+        struct.pack("<II", zlib.crc32(data), len(data)) ])
+
+def compress_blocks(data, compresslevel):
+    return b"".join([ compress_block(data[i:i + BGZF_BLOCK_SIZE], compresslevel)
+        for i in range(0, len(data), BGZF_BLOCK_SIZE) ])
+
+def timed_compress_blocks(data, compresslevel):
+    """
+    compress_blocks(), and the time it took.
+    """
+    t0 = time.perf_counter()
+    cdata = compress_blocks(data, compresslevel)
+    return cdata, time.perf_counter() - t0
+
+def decompress_blocks(data):
+    """
+    Decompress a byte string of complete BGZF blocks.
+    """
+    out = [ ]
+    pos = 0
+    while pos < len(data):
+        if not is_block_header(data, pos):
+            raise ValueError("Invalid BGZF block at compressed offset %d" % pos)
+        end = pos + struct.unpack_from("<H", data, pos + 16)[0] + 1
+        crc, size = struct.unpack_from("<II", data, end - 8)
+        block = zlib.decompress(data[pos + 18:end - 8], -15)
+        if len(block) != size or zlib.crc32(block) != crc:
+            raise ValueError("Corrupt BGZF block at compressed offset %d" % pos)
+        out.append(block)
+        pos = end
+    return b"".join(out)
+
+class BgzfWriter(io.RawIOBase):
+    """
+    Write a BGZF file, compressing batches of blocks in a thread pool. The
+    compressed batches are written in order; at most 2 * threads batches are
+    in flight, so memory use is bounded. An executor can be passed in to
+    share one thread pool between many files (as WriterPool does). `seconds`
+    is the time the threads spent compressing the batches written so far.
+    """
+    def __init__(self, path, mode = 'wb', compresslevel = 6, threads = None, executor = None):
+        self.fh = open(path, mode)
+        self.compresslevel = compresslevel
+        self.threads = threads if threads else default_threads()
+        self.own_executor = executor is None
+        self.executor = executor if executor else ThreadPoolExecutor(self.threads)
+        self.buffer = [ ]
+        self.size = 0
+        self.pending = deque()
+        self.task_size = BGZF_BLOCK_SIZE * BLOCKS_PER_TASK
+        self.seconds = 0.0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        n = len(data)
+        self.buffer.append(data)
+        self.size += n
+        if self.size >= self.task_size:
+            data = b"".join(self.buffer)
+            end = len(data) - len(data) % self.task_size
+            for i in range(0, end, self.task_size):
+                self.submit(data[i:i + self.task_size])
+            self.buffer = [ data[end:] ]
+            self.size = len(data) - end
+        return n
+
+    def submit(self, data):
+        self.pending.append(self.executor.submit(timed_compress_blocks, data, self.compresslevel))
+        while len(self.pending) > 2 * self.threads:
+            self.write_next()
+
+    def write_next(self):
+        """
+        Wait for the oldest batch in flight and write it.
+        """
+        cdata, seconds = self.pending.popleft().result()
+        self.seconds += seconds
+        self.fh.write(cdata)
+
+    def push(self):
+        """
+        Hand all buffered data to the thread pool without waiting for it,
+        split into one task per thread (in whole blocks), and write the
+        batches that are already compressed. Unlike flush(), this keeps the
+        threads busy when the writes come in chunks smaller than a task.
+        """
+        if self.size:
+            data = b"".join(self.buffer)
+            blocks = -(-len(data) // BGZF_BLOCK_SIZE)
+            step = -(-blocks // self.threads) * BGZF_BLOCK_SIZE
+            for i in range(0, len(data), step):
+                self.submit(data[i:i + step])
+            self.buffer = [ ]
+            self.size = 0
+        while self.pending and self.pending[0].done():
+            self.write_next()
+
+    def flush(self):
+        if self.fh.closed:
+            return
+        if self.size:
+            self.submit(b"".join(self.buffer))
+            self.buffer = [ ]
+            self.size = 0
+        while self.pending:
+            self.write_next()
+        self.fh.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.flush()
+            self.fh.write(BGZF_EOF)
+        finally:
+            self.fh.close()
+            if self.own_executor:
+                self.executor.shutdown()
+            super().close()
+
+class BgzfReader(io.RawIOBase):
+    """
+    Read a BGZF file, decompressing batches of blocks in a thread pool while
+    the caller works on the data already decompressed. The block boundaries
+    are taken from the block headers, so the compressed data is only read
+    once, sequentially.
+    """
+    def __init__(self, path, threads = None, read_size = 4 << 20):
+        self.fh = open(path, 'rb')
+        self.threads = threads if threads else default_threads()
+        self.executor = ThreadPoolExecutor(self.threads)
+        self.read_size = read_size
+        self.rest = b""      # compressed data after the last complete block
+        self.eof = False
+        self.pending = deque()
+        self.data = b""      # decompressed data not yet returned
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def fill(self):
+        """
+        Keep up to 2 * threads batches of complete blocks in flight.
+        """
+        while not self.eof and len(self.pending) < 2 * self.threads:
+            raw = self.fh.read(self.read_size)
+            if not raw:
+                self.eof = True
+                if self.rest:
+                    raise ValueError("Truncated BGZF file")
+                break
+            buf = self.rest + raw
+            pos = 0
+            while pos + 18 <= len(buf):
+                end = pos + struct.unpack_from("<H", buf, pos + 16)[0] + 1
+                if end > len(buf):
+                    break
+                pos = end
+            self.rest = buf[pos:]
+            if pos:
+                self.pending.append(self.executor.submit(decompress_blocks, buf[:pos]))
+
+    def read(self, size = -1):
+        if size is None or size < 0:
+            return b"".join(iter(lambda: self.read(1 << 24), b""))
+        while self.pos >= len(self.data):
+            self.fill()
+            if not self.pending:
+                return b""
+            self.data = self.pending.popleft().result()
+            self.pos = 0
+        out = self.data[self.pos:self.pos + size]
+        self.pos += len(out)
+        return out
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        for f in self.pending:
+            f.cancel()
+        self.executor.shutdown()
+        self.fh.close()
+        super().close()
+
+class PipeFile(io.RawIOBase):
+    """
+    Read from or write to a file through an external (de)compressor such as
+    pigz or zstd. When reading, a failure of the program (e.g. a truncated
+    input file) is raised as ValueError at the end of the data.
+    """
+    def __init__(self, command, path, mode = 'rb'):
+        if shutil.which(command[0]) is None:
+            raise ValueError(command[0] + " is not installed")
+        self.reading = 'r' in mode
+        if self.reading:
+            self.proc = subprocess.Popen(command + [ path ], stdout = subprocess.PIPE)
+            self.fh = self.proc.stdout
+        else:
+            with open(path, mode) as out:
+                self.proc = subprocess.Popen(command, stdin = subprocess.PIPE, stdout = out)
+            self.fh = self.proc.stdin
+        self.command = command[0]
+
+    def readable(self):
+        return self.reading
+
+    def writable(self):
+        return not self.reading
+
+    def read(self, size = -1):
+        data = self.fh.read(size)
+        if not data and size != 0 and self.proc.wait():
+            raise ValueError(self.command + " failed with exit code %d" % self.proc.returncode)
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def write(self, data):
+        return self.fh.write(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self.fh.close()
+        # a reader that stops early makes the program exit with SIGPIPE
+        if self.proc.wait() and not self.reading:
+            raise IOError(self.command + " failed with exit code %d" % self.proc.returncode)
+        super().close()
+
+def open_input(path, backend = "auto", threads = None):
+    """
+    Open a file for reading in binary mode, decompressing it on the fly if
+    it ends in .gz, .bz2 or .zst.
+    """
+    threads = threads if threads else default_threads()
+    if path.endswith(".zst"):
+        return PipeFile([ "zstd", "-dcq" ], path)
+    if path.endswith(".bz2"):
+        return bz2.open(path, 'rb')
+    if not path.endswith(".gz"):
+        return open(path, 'rb')
+    if backend == "auto":
+        if is_bgzf(path):
+            backend = "bgzf"
+        elif shutil.which("pigz"):
+            backend = "pigz"
+        else:
+            backend = "gzip"
+    if backend == "bgzf":
+        if not is_bgzf(path):
+            raise ValueError(path + " is not a BGZF file")
+        return BgzfReader(path, threads)
+    if backend == "pigz":
+        return PipeFile([ "pigz", "-dc", "-p", str(threads) ], path)
+    if backend == "zstd":
+        return PipeFile([ "zstd", "-dcq" ], path)
+    if backend == "gzip":
+        return gzip.open(path, 'rb')
+    raise ValueError("Unknown backend: " + backend)
+
+def open_output(path, mode = 'wb', backend = "auto", compresslevel = 6, threads = None, executor = None):
+    """
+    Open a compressed file for writing (mode 'wb') or appending (mode 'ab').
+    The format follows the file name: files ending in .zst are written as
+    zstd, all others as gzip, so the zstd backend only accepts .zst files.
+    Appending adds a new gzip or zstd frame, which is still a valid file.
+    """
+    threads = threads if threads else default_threads()
+    if backend == "zstd" and not path.endswith(".zst"):
+        raise ValueError("the zstd backend writes zstd, but " + path + " does not end in .zst")
+    if path.endswith(".zst"):
+        return PipeFile([ "zstd", "-qc", "-%d" % compresslevel, "-T%d" % threads ], path, mode)
+    if backend in ("auto", "bgzf"):
+        return BgzfWriter(path, mode, compresslevel, threads, executor)
+    if backend == "pigz":
+        return PipeFile([ "pigz", "-c", "-%d" % compresslevel, "-p", str(threads) ], path, mode)
+    if backend == "gzip":
+        return gzip.open(path, mode, compresslevel = compresslevel)
+    raise ValueError("Unknown backend: " + backend)
@@ -0,0 +1,248 @@
+#!/usr/bin/python
+
+"""
+Write ID3v2.3/2.4 tags in-process, without starting id3v2 for every file.
+
+Text frames are replaced, all other frames (cover art, comments, ...) are
+kept. If the new tag fits into the space of the old one (its padding), only
+the tag is rewritten in place and the audio data is not touched; otherwise
+the file is rewritten once, with PADDING bytes of padding so that later
+changes fit. Files without a tag get an ID3v2.3 tag, like id3v2 writes.
+
+The file naming rule of yt-ripper.py (get_file_stem) is kept here too, so
+that rename-old-files.py names files exactly the same way.
+
+Usage as a script (retag every directory from its playlist.info.json):
+
+    id3tools.py DIR [DIR ...]
+"""
+
+import os
+import re
+import sys
+import json
+import shutil
+import struct
+import tempfile
+from pathlib import Path
+
+# padding added when the tag has to be rewritten
+PADDING = 2048
+
+# tag fields and the frames they are written to; the year frame depends on
+# the version (TYER in 2.3, TDRC in 2.4)
+FRAMES = { "title": "TIT2", "artist": "TPE1", "album": "TALB", "track": "TRCK" }
+
+class ID3Error(Exception):
+    pass
+
+def syncsafe(n):
+    return bytes([ (n >> 21) & 0x7f, (n >> 14) & 0x7f, (n >> 7) & 0x7f, n & 0x7f ])
+
+def unsyncsafe(b):
+    return (b[0] << 21) | (b[1] << 14) | (b[2] << 7) | b[3]
+
+def read_tag(fh):
+    """
+    Read the ID3v2 tag at the start of an open file. Returns (version,
+    frames, size): the major version (3 or 4, None without a tag), the
+    frames as a list of (frame id, flags, data) in file order, and the number
+    of bytes the tag takes up (0 without a tag). ID3v2.2 tags are reported
+    with their size but no frames, so they are replaced.
+    """
+    fh.seek(0)
+    header = fh.read(10)
+    if len(header) < 10 or header[:3] != b"ID3" or header[3] == 0xff:
+        return None, [ ], 0
+    version, flags = header[3], header[5]
+    size = unsyncsafe(header[6:10])
+    total = 10 + size + (10 if version == 4 and flags & 0x10 else 0)
+    if version not in (3, 4):
+        return 3, [ ], total
+    data = fh.read(size)
+    if len(data) < size:
+        raise ID3Error("truncated ID3 tag")
+    if version == 3 and flags & 0x80: # whole tag unsynchronised
+        data = data.replace(b"\xff\x00", b"\xff")
+    pos = 0
+    if flags & 0x40: # skip the extended header
+        ext = unsyncsafe(data[0:4]) if version == 4 else struct.unpack(">I", data[0:4])[0] + 4
+        pos = ext
+    frames = [ ]
+    while pos + 10 <= len(data) and data[pos] != 0:
+        frame_id = data[pos:pos+4].decode("latin-1")
+        n = unsyncsafe(data[pos+4:pos+8]) if version == 4 else struct.unpack(">I", data[pos+4:pos+8])[0]
+        frames.append((frame_id, data[pos+8:pos+10], data[pos+10:pos+10+n]))
+        pos += 10 + n
+    return version, frames, total
+
+def text_frame(frame_id, text, version):
+    """
+    Frame data of a text frame: ISO-8859-1 if possible, otherwise UTF-16 in
+    ID3v2.3 and UTF-8 in ID3v2.4.
+    """
+    try:
+        data = b"\x00" + text.encode("latin-1")
+    except UnicodeEncodeError:
+        data = b"\x03" + text.encode("utf-8") if version == 4 else b"\x01" + text.encode("utf-16")
+    return (frame_id, b"\x00\x00", data)
+
+def render(frames, version, size):
+    """
+    The complete tag, padded to `size` bytes (header included).
+    """
+    body = b"".join(f.encode("latin-1") + (syncsafe(len(d)) if version == 4 else struct.pack(">I", len(d))) + flags + d
+        for f, flags, d in frames)
+    if size - 10 < len(body):
+        raise ID3Error("tag does not fit")
+    return b"ID3" + bytes([ version, 0, 0 ]) + syncsafe(size - 10) + body + b"\x00" * (size - 10 - len(body))
+
+def write_tags(path, tags):
+    """
+    Set the text frames of an MP3 file. `tags` maps field names (title,
+    artist, album, track, year) to strings; empty values remove the frame.
+    Returns True if the tag was rewritten in place, False if the whole file
+    had to be rewritten.
+    """
+    with open(path, "rb+") as fh:
+        version, frames, old_size = read_tag(fh)
+        version = version if version else 3
+        fields = dict(FRAMES, year = "TDRC" if version == 4 else "TYER")
+        replace = set(fields[k] for k in tags)
+        frames = [ f for f in frames if f[0] not in replace ]
+        for key, value in tags.items():
+            if value:
+                frames.append(text_frame(fields[key], value, version))
+        needed = 10 + sum(10 + len(d) for f, flags, d in frames)
+        if old_size and needed <= old_size:
+            fh.seek(0)
+            fh.write(render(frames, version, old_size))
+            return True
+        # no room: write a new file with the new tag and the audio data
+        fd, tmp = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(path)), suffix = ".tmp")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                out.write(render(frames, version, needed + PADDING))
+                fh.seek(old_size)
+                shutil.copyfileobj(fh, out, 1 << 20)
+            shutil.copymode(path, tmp)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return False
+
+def tags_from_info(data):
+    """
+    Tag fields from yt-dlp info JSON, with the same fallbacks yt-ripper.py
+    always used: artist from artist, creator or uploader; year from
+    release_year or upload_date; album and track from the playlist. Returns
+    (tags, problems), the number of fields that were missing. Raises
+    ValueError if there is no artist at all.
+    """
+    for key in ("artist", "creator", "uploader"):
+        if key in data:
+            artist = data[key]
+            break
+    else:
+        raise ValueError("no artist for " + str(data.get("title")))
+    if "release_year" in data:
+        year = str(data["release_year"])
+    else:
+        year = str(data.get("upload_date", ""))[0:4]
+    album = ""
+    track = ""
+    if "playlist" in data:
+        album = data["playlist"]
+        track = str(data["playlist_index"]) if data.get("playlist_index") is not None else ""
+    problems = 0
+    if album is None:
+        album = ""
+        problems = problems + 1
+    if artist is None:
+        artist = ""
+        problems = problems + 1
+    return { "title": data["title"], "artist": artist, "album": album, "year": year, "track": track }, problems
+
+def cleanup_title(filename):
+    """
+    This function removes special character (sequences) from the title to produce a safe file name.
+    yt-dlp does the same, so we need to reproduce the same pattern.
+    """
+    clean_title = re.sub("\\?",  "",    filename)  # question marks are removed by yt-dlp
+    clean_title = re.sub("\\|+", "_",   clean_title) # pipes replaced with _ by yt-dlp
+    clean_title = re.sub(": ",  " - ", clean_title) # yt-dlp doesn't like :
+    clean_title = re.sub('"',   "'",   clean_title) # double quotes to single quotes
+    return clean_title
+
+def get_file_stem(json_data):
+    clean_title = cleanup_title(json_data["title"])
+    # if part of a playlist
+    if "playlist_index" in json_data and json_data["playlist_index"] is not None:
+        file_stem = "{index:02d}_{title}_{id}".format(index = json_data["playlist_index"], title = clean_title, id = json_data["id"])
+    # otherwise file name without index
+    else:
+        file_stem = "{title}_{id}".format(title = clean_title, id = json_data["id"])
+    return file_stem
+
+def files_by_id(directory, ids, all_files = False):
+    """
+    Map video IDs to the MP3 files in `directory` named <anything>_<id>.mp3.
+    The directory is listed once. With all_files, each ID maps to a list of
+    all its files, otherwise to one of them.
+    """
+    files = { }
+    for mp3 in Path(directory).glob("*.mp3"):
+        # IDs may contain underscores, so try every split point
+        stem = mp3.stem
+        for i, c in enumerate(stem):
+            if c == "_" and stem[i+1:] in ids:
+                if all_files:
+                    files.setdefault(stem[i+1:], [ ]).append(mp3)
+                else:
+                    files[stem[i+1:]] = mp3
+                break
+    return files
+
+def tag_directory(directory, info_json = None):
+    """
+    Tag all MP3 files in `directory` from the playlist info JSON (by default
+    playlist.info.json in the same directory, as yt-ripper.py writes it). Files are
+    matched to playlist entries by the video ID at the end of the file name
+    (<anything>_<id>.mp3), so renamed titles do not matter. Returns a list of
+    (file or entry title, message) for the entries that could not be tagged
+    cleanly.
+    """
+    directory = Path(directory)
+    if info_json is None:
+        info_json = Path(directory, "playlist.info.json")
+    with open(info_json) as f:
+        playlist = json.load(f)
+    files = files_by_id(directory, set(entry["id"] for entry in playlist["entries"] if entry))
+    problems = [ ]
+    for entry in playlist["entries"]:
+        if not entry:
+            continue
+        mp3 = files.get(entry["id"])
+        if mp3 is None:
+            problems.append((entry["title"], "mp3 file not found"))
+            continue
+        try:
+            tags, missing = tags_from_info(entry)
+            write_tags(mp3, tags)
+            if missing:
+                problems.append((mp3, "missing artist or album"))
+        except (OSError, ValueError, ID3Error) as e:
+            problems.append((mp3, str(e)))
+    return problems
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: {program} DIR [DIR ...]".format(program = sys.argv[0]))
+        sys.exit(1)
+    failed = 0
+    for d in sys.argv[1:]:
+        for f, message in tag_directory(d):
+            print("{f}: {message}".format(f = f, message = message))
+            failed = failed + 1
+    sys.exit(1 if failed else 0)
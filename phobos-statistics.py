@@ -1,11 +1,13 @@
 #!/usr/bin/python
 
-from __future__ import division
+from __future__ import division, print_function
 import sys
-import re
-import fastaParser
+import numpy as np
+import fastatools
+import compotools
+import phobostools
 
-print "Call: " + " ".join(sys.argv)
+print("Call: " + " ".join(sys.argv))
 
 if (len(sys.argv) != 3):
 	sys.exit("Need two arguments!")
@@ -13,90 +15,68 @@ if (len(sys.argv) != 3):
 phobosfile = sys.argv[-2]
 genomefile = sys.argv[-1]
 
-# regexes
-re_seq             = re.compile("^>(\S+_\d+)")
-re_nucl            = re.compile("^\s*\S+nucleotide\s+(\d+) :\s+(\d+)")
-re_acgtu           = re.compile("^number of ACGTU characters: (\d+)")
-re_split           = re.compile("\s+\|\s+")
-re_non_nucleotides = re.compile("([^A-Za-z])")
+# parse phobos file, store the repeats in compact per-scaffold arrays
+try:
+	report = phobostools.load(phobosfile)
+except ValueError as e: sys.exit("Fatal: %s" % e)
 
-# data structure 
-data_for = { }
-scaffold = ""
-fields = [ ]
-
-# parse phobos file, store everything in multi-dim structure
-fh = open(phobosfile)
-
-line = fh.readline()
-
-if not re.match("# Results computed with:", line):
-	raise ValueError, "Not a Phobos file"
-
-for line in fh:
-	# is this an "input file name" line?
-	m = re.match("^# Input file name:\s+(\S+)$", line)
-	if m: 
-		pass
-
-	# is this a ">scaffold" line?
-	m = re_seq.match(line)
-	if m:
-		scaffold = m.group(1)
-		data_for[scaffold] = [ ]
-		print "matched: " + scaffold
-		next
-
-	# is this a "nucleotide" line?
-	# if so, add this repeat to the data structure
-	m = re_nucl.match(line)
-	if m: 
-		fields = re_split.split(line)
-		if fields:
-			data_for[scaffold].append(
-				{
-					'start': int(m.group(1)),
-					'end': int(m.group(2)),
-					'unit': fields[-1][5:].rstrip()
-				}
-			)
-		next
-
-fh.close()
+for scaffold in report.scaffolds:
+	print("matched: " + scaffold)
 
 winsize = 50
 
-count_a = 0
-count_t = 0
-count_c = 0
-count_g = 0
-
-fh = open(genomefile)
-
-while True:
-	try:
-		for hdr, seq in fastaParser.parse(fh):
-			print ">%s" % hdr
-			for repeat in data_for[hdr]:
-				start = repeat['start']
-				end   = repeat['end']
-
-				
-				gc = 0.0
-
-				for i in range(start, end-winsize):
-					subseq = seq[i:i+winsize]
-					count_a = subseq.count('A')
-					count_t = subseq.count('T')
-					count_c = subseq.count('C')
-					count_g = subseq.count('G')
-					#--------------------------------------------------
-					# print "perc A: %.2f" % (count_a / winsize)
-					# print "perc T: %.2f" % (count_t / winsize)
-					# print "perc C: %.2f" % (count_c / winsize)
-					# print "perc G: %.2f" % (count_g / winsize)
-					#-------------------------------------------------- 
-
-				
-				print "repeat [%d-%d]: range %d to %d: GC: %f" % (start, end, start, end, (count_g + count_c) / winsize)
-	except ValueError: sys.exit("Fatal: Not a Fasta file?")
+# sorted interval structure: per scaffold, arrays of repeat starts and ends,
+# ordered by start position
+intervals = { }
+for scaffold, table in report.scaffolds.items():
+	starts = np.frombuffer(table.starts, dtype = np.int64)
+	ends   = np.frombuffer(table.ends,   dtype = np.int64)
+	order  = np.lexsort((ends, starts))
+	intervals[scaffold] = (starts[order], ends[order])
+
+G, C, A, T = [ compotools.BASES.index(b) for b in b"GCAT" ]
+
+# random-access index on the genome: only the part of each scaffold that is
+# covered by repeats is read from disk
+try:
+	index = fastatools.FastaIndex(genomefile)
+except ValueError: sys.exit("Fatal: Not a Fasta file?")
+
+for hdr in intervals:
+	starts, ends = intervals[hdr]
+	if hdr not in index:
+		print("Warning: scaffold %s not found in %s" % (hdr, genomefile), file = sys.stderr)
+		continue
+	print(">%s" % hdr)
+	if not len(starts):
+		continue
+
+	# repeats that overlap are grouped into clusters; one linear pass over each
+	# cluster gives prefix counts for A/C/G/T, so the composition of any
+	# [start, end) range in it is a difference of two entries. only one
+	# cluster's prefix counts are in memory at a time, not the whole scaffold's
+	reach = np.maximum.accumulate(ends)
+	bounds = [ 0 ] + (np.nonzero(starts[1:] >= reach[:-1])[0] + 1).tolist() + [ len(starts) ]
+	for first, last in zip(bounds[:-1], bounds[1:]):
+		offset = int(starts[first])
+		prefix = compotools.prefix_counts(index.fetch(hdr, offset, int(reach[last-1])))
+		for start, end in zip(starts[first:last].tolist(), ends[first:last].tolist()):
+			s = start - offset
+			e = min(end - offset, prefix.shape[1] - 1)
+			length = e - s
+			if length <= 0:
+				continue
+			counts = prefix[:, e] - prefix[:, s]
+			gc = (counts[G] + counts[C]) / length
+			# sliding windows inside the repeat, as before: starts from start to end-winsize
+			# (none if the repeat is shorter than the window; the bounds must not
+			# go negative, or the slices wrap around)
+			hi = max(s, e - winsize)
+			win_gc = ((prefix[G, s+winsize:hi+winsize] - prefix[G, s:hi]) + (prefix[C, s+winsize:hi+winsize] - prefix[C, s:hi])) / winsize
+			if len(win_gc):
+				print("repeat [%d-%d]: A: %f C: %f G: %f T: %f GC: %f windows: %d window GC min/mean/max: %f/%f/%f" % (
+					start, end, counts[A] / length, counts[C] / length, counts[G] / length, counts[T] / length, gc,
+					len(win_gc), win_gc.min(), win_gc.mean(), win_gc.max()))
+			else:
+				print("repeat [%d-%d]: A: %f C: %f G: %f T: %f GC: %f windows: 0" % (
+					start, end, counts[A] / length, counts[C] / length, counts[G] / length, counts[T] / length, gc))
@@ -0,0 +1,118 @@
+#!/usr/bin/python
+
+"""
+Streaming parser for Phobos tandem repeat reports. Repeats are stored per
+scaffold in parallel typed arrays (start, end, unit id) instead of one dict
+per repeat; repeat units are interned, so each distinct unit string is only
+stored once.
+"""
+
+import re
+from array import array
+
+# regexes, only tried on lines that pass a cheap prefix or substring check
+re_seq  = re.compile(r"^>(\S+)")
+re_nucl = re.compile(r"^\s*\S+nucleotide\s+(\d+) :\s+(\d+)")
+
+class RepeatTable:
+	"""
+	Repeats of one scaffold: start and end positions as 64-bit integer arrays
+	and unit ids (indices into PhobosReport.units) as an unsigned int array.
+	"""
+	__slots__ = ('starts', 'ends', 'unit_ids')
+
+	def __init__(self):
+		self.starts   = array('q')
+		self.ends     = array('q')
+		self.unit_ids = array('I')
+
+	def __len__(self):
+		return len(self.starts)
+
+	def __iter__(self):
+		return zip(self.starts, self.ends, self.unit_ids)
+
+	def append(self, start, end, unit_id):
+		self.starts.append(start)
+		self.ends.append(end)
+		self.unit_ids.append(unit_id)
+
+class PhobosReport:
+	"""
+	All repeats of a Phobos report: `scaffolds` maps scaffold names (in file
+	order) to RepeatTable objects, `units` holds the interned unit strings.
+	"""
+	def __init__(self):
+		self.scaffolds = { }
+		self.units = [ ]
+		self.unit_ids = { }
+
+	def intern(self, unit):
+		uid = self.unit_ids.get(unit)
+		if uid is None:
+			uid = self.unit_ids[unit] = len(self.units)
+			self.units.append(unit)
+		return uid
+
+	def unit(self, unit_id):
+		return self.units[unit_id]
+
+	def __len__(self):
+		return sum(len(t) for t in self.scaffolds.values())
+
+def scan(handle):
+	"""
+	Yield (scaffold, None, None, None) for every sequence line and (scaffold,
+	start, end, unit) for every repeat line of a Phobos report.
+	"""
+	line = handle.readline()
+	if not line.startswith("# Results computed with:"):
+		raise ValueError("Not a Phobos file")
+
+	scaffold = None
+	for line in handle:
+		# is this a ">scaffold" line?
+		if line.startswith(">"):
+			m = re_seq.match(line)
+			if m:
+				scaffold = m.group(1)
+				yield scaffold, None, None, None
+			continue
+		# is this a "nucleotide" line? comments and the various summary
+		# lines are skipped without running the regex
+		if line.startswith("#") or "nucleotide" not in line:
+			continue
+		m = re_nucl.match(line)
+		if m:
+			if scaffold is None:
+				raise ValueError("Repeat before the first sequence line: " + line)
+			# the unit is the last |-separated field: "unit ACG"
+			unit = line[line.rfind("|") + 1:].lstrip()[5:].rstrip()
+			yield scaffold, int(m.group(1)), int(m.group(2)), unit
+
+def parse(handle):
+	"""
+	Yield (scaffold, start, end, unit) for every repeat in a Phobos report.
+	"""
+	for scaffold, start, end, unit in scan(handle):
+		if start is not None:
+			yield scaffold, start, end, unit
+
+def load(handle):
+	"""
+	Read a Phobos report into a PhobosReport. `handle` can be an open file or
+	a file name. Scaffolds without repeats get an empty RepeatTable.
+	"""
+	if isinstance(handle, str):
+		with open(handle) as fh:
+			return load(fh)
+	report = PhobosReport()
+	table = None
+	for scaffold, start, end, unit in scan(handle):
+		if start is None:
+			table = report.scaffolds.get(scaffold)
+			if table is None:
+				table = report.scaffolds[scaffold] = RepeatTable()
+			continue
+		table.append(start, end, report.intern(unit))
+	return report
@@ -3,30 +3,119 @@
 import os
 import sys
 import json
-import re
+import argparse
 from pathlib import Path
+import id3tools
 
-def main(json_file, mp3_dir):
-    p = Path(mp3_dir).glob("*.mp3")
-    files = [ x for x in p if x.suffix == ".mp3" ]
+def playlist_tracks(json_file):
+    """
+    The tracks of a playlist JSON file: the entries of all its lists.
+    """
     with open(json_file) as f:
-        data   = json.load(f)
-        for k, v in data.items():
-            if isinstance(v, list):
-                for track in v:
-                    #print(track["title"], track["playlist_index"])
-                    clean_title = re.sub("\?", "", track["title"]) # remove ?
-                    clean_title = re.sub("\|+", "_", clean_title) # replace | w _
-                    new_file_name = Path(mp3_dir, "{index:02d}_{title}_{id}.{ext}".format(index = track["playlist_index"], title = clean_title, id = track["id"], ext = "mp3"))
-                    old_file_name = Path(mp3_dir, "{title}_{id}.{ext}".format(title = clean_title, id = track["id"], ext = "mp3"))
-                    if new_file_name.exists():
-                        print("new file {file} exists, doing nothing".format(file = new_file_name))
-                        next
-                    elif old_file_name.exists():
-                        print("old file {file} exists, renaming".format(file = old_file_name))
-                        old_file_name.rename(new_file_name)
-                        next
-                    else:
-                        print("Problem: mp3 file for '{title}' not found\nlooked for: {file}".format(title = track["title"], file = old_file_name))
+        data = json.load(f)
+    return [ track for v in data.values() if isinstance(v, list) for track in v if track ]
+
+def plan_renames(playlists):
+    """
+    Plan the renames for a list of (JSON file, mp3 directory) pairs. Every
+    directory is listed once, however many playlists it holds, and files are
+    found by video ID, so titles that changed since the download do not
+    matter. Returns (renames, problems, n_ok): the renames as (old path, new
+    path), the problems as messages, and the number of files that already
+    have the right name. A file is never renamed twice and no two files are
+    renamed to the same name.
+    """
+    tracks = { }
+    for json_file, mp3_dir in playlists:
+        tracks.setdefault(Path(mp3_dir), [ ]).extend(playlist_tracks(json_file))
+    renames = [ ]
+    problems = [ ]
+    n_ok = 0
+    for mp3_dir, dir_tracks in tracks.items():
+        # the directory is listed once, the files are indexed by video ID
+        by_id = { k: set(f.name for f in v) for k, v in id3tools.files_by_id(mp3_dir, set(track["id"] for track in dir_tracks), all_files = True).items() }
+        planned = [ ]
+        for track in dir_tracks:
+            if track.get("playlist_index") is None:
+                problems.append("'{title}' has no playlist index".format(title = track["title"]))
+            else:
+                planned.append((track, id3tools.get_file_stem(track) + ".mp3"))
+        # files that already have their new name stay where they are
+        used = set(target for track, target in planned if target in by_id.get(track["id"], ()))
+        for track, target in planned:
+            if target in by_id.get(track["id"], ()):
+                n_ok = n_ok + 1
+                continue
+            candidates = [ name for name in by_id.get(track["id"], [ ]) if name not in used ]
+            if not candidates and track["id"] in by_id:
+                problems.append("mp3 file for '{title}' in {dir} already belongs to another track with the same ID".format(title = track["title"], dir = mp3_dir))
+            elif not candidates:
+                problems.append("mp3 file for '{title}' not found in {dir}".format(title = track["title"], dir = mp3_dir))
+            elif len(candidates) > 1:
+                problems.append("several mp3 files for '{title}' in {dir}: {files}".format(title = track["title"], dir = mp3_dir, files = ", ".join(sorted(candidates))))
+            elif target in used:
+                problems.append("{file} would be renamed to {target}, which is already taken".format(file = Path(mp3_dir, candidates[0]), target = target))
+            else:
+                used.update([ candidates[0], target ])
+                renames.append((Path(mp3_dir, candidates[0]), Path(mp3_dir, target)))
+    return renames, problems, n_ok
+
+def reconcile(playlists, tag = False, dry_run = False):
+    """
+    Rename the mp3 files of many playlists in one batch: plan all renames
+    first, then apply them (or only print them with dry_run). With tag, the
+    files are (re)tagged afterwards. Returns the number of problems.
+    """
+    renames, problems, n_ok = plan_renames(playlists)
+    for message in problems:
+        print("Problem: {message}".format(message = message))
+    n_renamed = 0
+    for old_file_name, new_file_name in renames:
+        if dry_run:
+            print("would rename {old} -> {new}".format(old = old_file_name, new = new_file_name.name))
+            continue
+        if new_file_name.exists(): # appeared since the directory was listed
+            print("Problem: {file} exists, not renaming {old}".format(file = new_file_name, old = old_file_name))
+            problems.append(new_file_name)
+            continue
+        print("renaming {old} -> {new}".format(old = old_file_name, new = new_file_name.name))
+        old_file_name.rename(new_file_name)
+        n_renamed = n_renamed + 1
+    print("{n} files {renamed}, {ok} already named correctly, {p} problems".format(n = len(renames) if dry_run else n_renamed,
+        renamed = "to rename" if dry_run else "renamed", ok = n_ok, p = len(problems)))
+    if tag and not dry_run:
+        # (re)tag all files in one go, in-process
+        for json_file, mp3_dir in playlists:
+            for f, message in id3tools.tag_directory(mp3_dir, json_file):
+                print("Problem tagging {file}: {message}".format(file = f, message = message))
+                problems.append(f)
+    return len(problems)
+
+def main(json_file, mp3_dir, tag = False, dry_run = False):
+    return reconcile([ (json_file, mp3_dir) ], tag, dry_run)
+
+def playlist_paths(path):
+    """
+    (JSON file, mp3 directory) for a playlist directory with a
+    playlist.info.json as yt-ripper.py writes it, or for a JSON file in the
+    directory with the mp3 files.
+    """
+    path = Path(path)
+    if path.is_dir():
+        return Path(path, "playlist.info.json"), path
+    return path, path.parent
+
 if __name__ == "__main__":
-    main(sys.argv[1], sys.argv[2])
+    parser = argparse.ArgumentParser(description = "Rename mp3 files from playlists to the current yt-ripper.py naming scheme")
+    parser.add_argument("paths", nargs = "+", metavar = "PATH", help = "JSON_FILE MP3_DIR: the playlist .info.json file and the directory with the mp3 files; with --bulk any number of playlist directories (with a playlist.info.json) and .info.json files (next to their mp3 files)")
+    parser.add_argument("--bulk", action = "store_true", help = "reconcile many playlists in one batch")
+    parser.add_argument("-n", "--dry-run", action = "store_true", help = "only print the renames")
+    parser.add_argument("--tag", action = "store_true", help = "also write ID3 tags to all mp3 files from the JSON file")
+    args = parser.parse_args()
+    if args.bulk:
+        playlists = [ playlist_paths(path) for path in args.paths ]
+    elif len(args.paths) == 2:
+        playlists = [ tuple(args.paths) ]
+    else:
+        parser.error("expected JSON_FILE MP3_DIR, or --bulk with playlist directories or JSON files")
+    sys.exit(1 if reconcile(playlists, args.tag, args.dry_run) else 0)
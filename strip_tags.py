@@ -1,16 +1,44 @@
 #!/usr/bin/python
 
-from HTMLParser import HTMLParser
-import fileinput
+"""
+Strip HTML tags and print the text. The input is fed to the parser in
+chunks and the text is written as soon as it is parsed, so memory use does
+not grow with the input size.
+
+Usage: strip_tags.py [FILE ...]                    all files (or stdin) to stdout
+       strip_tags.py -o DIR [-j N] FILE [FILE ...]  each FILE to DIR/FILE.txt, N files at a time
+"""
+
+from __future__ import print_function
+
+try:
+    from HTMLParser import HTMLParser
+except ImportError:
+    from html.parser import HTMLParser
+import os
+import sys
+import argparse
+import multiprocessing
+
+# characters fed to the parser at a time
+CHUNK_SIZE = 1 << 20
+
+# characters kept back when a long stretch without tags is fed to the parser;
+# more than the longest character reference
+TAIL_SIZE = 64
 
 class MLStripper(HTMLParser):
-    def __init__(self):
+    def __init__(self, out = None):
         self.reset()
         self.strict = False
         self.convert_charrefs= True
         self.fed = []
+        self.out = out
     def handle_data(self, d):
-        self.fed.append(d)
+        if self.out is None:
+            self.fed.append(d)
+        else:
+            self.out.write(d)
     def get_data(self):
         return ''.join(self.fed)
 
@@ -19,9 +47,88 @@ def strip_tags(html):
     s.feed(html)
     return s.get_data()
 
-html = ""
+def read_chunks(paths, size = CHUNK_SIZE):
+    """
+    The contents of the files (stdin for '-' or no files at all) one after
+    another, in chunks of `size` characters, like fileinput reads them.
+    """
+    for path in paths or [ '-' ]:
+        fh = sys.stdin if path == '-' else open(path)
+        try:
+            for chunk in iter(lambda: fh.read(size), ''):
+                yield chunk
+        finally:
+            if fh is not sys.stdin:
+                fh.close()
+
+def strip_stream(chunks, out):
+    """
+    Write the text of the HTML in `chunks` to `out`, followed by a newline.
+    The parser is not closed, so unfinished markup at the end is dropped,
+    as strip_tags() does. The only difference: if the input ends in more
+    than CHUNK_SIZE characters of text without a tag, and in a character
+    reference without ';', strip_tags() drops all of that text, but here
+    the part that was already fed is written.
+    """
+    s = MLStripper(out)
+    rest = ''
+    for chunk in chunks:
+        # feed up to the last '<' only: the parser keeps the last piece of
+        # text back if it might end in a cut character reference, so the
+        # text at the end must reach it in one piece, as with strip_tags()
+        rest = rest + chunk
+        cut = rest.rfind('<')
+        if cut <= 0 and len(rest) > CHUNK_SIZE:
+            # no tag for a long time: keep memory bounded, the parser still
+            # waits for the rest of a character reference cut at the end
+            cut = len(rest) - TAIL_SIZE
+        if cut > 0:
+            s.feed(rest[:cut])
+            rest = rest[cut:]
+    s.feed(rest)
+    out.write('\n')
+
+def output_file(path, outdir):
+    return os.path.join(outdir, os.path.splitext(os.path.basename(path))[0] + '.txt')
+
+def strip_file(job):
+    path, outdir = job
+    with open(output_file(path, outdir), 'w') as out:
+        strip_stream(read_chunks([ path ]), out)
+    return path
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Strip HTML tags and print the text')
+    parser.add_argument('files', nargs = '*', help = 'HTML files (default: stdin)')
+    parser.add_argument('-o', '--outdir', help = 'write the text of each file to OUTDIR/<name>.txt instead of all text to stdout')
+    parser.add_argument('-j', '--jobs', type = int, default = 1, help = 'number of files processed at the same time with --outdir (default: 1)')
+    args = parser.parse_args()
 
-for line in fileinput.input():
-    html = html + line
+    if args.outdir is None:
+        strip_stream(read_chunks(args.files), sys.stdout)
+        sys.exit()
 
-print(strip_tags(html))
+    if not args.files or '-' in args.files:
+        parser.error('--outdir needs input files')
+    names = [ output_file(f, args.outdir) for f in args.files ]
+    if len(set(names)) < len(names):
+        parser.error('input files with the same name would overwrite each other in ' + args.outdir)
+    if not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+    jobs = [ (f, args.outdir) for f in args.files ]
+    if args.jobs <= 1:
+        for path in map(strip_file, jobs):
+            print(path + ' -> ' + output_file(path, args.outdir), file = sys.stderr)
+        sys.exit()
+    pool = multiprocessing.Pool(args.jobs)
+    try:
+        for path in pool.imap_unordered(strip_file, jobs):
+            print(path + ' -> ' + output_file(path, args.outdir), file = sys.stderr)
+    except BaseException:
+        # a worker failed or we were interrupted: stop the other workers
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
@@ -0,0 +1,32 @@
+import json
+import importlib.util
+from pathlib import Path
+
+spec = importlib.util.spec_from_file_location("rename_old_files", Path(__file__).with_name("rename-old-files.py"))
+rename_old_files = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(rename_old_files)
+
+def make_playlist(directory, entries, files):
+    with open(Path(directory, "playlist.info.json"), "w") as f:
+        json.dump({ "title": "x", "entries": entries }, f)
+    for name in files:
+        Path(directory, name).write_bytes(b"")
+    return Path(directory, "playlist.info.json")
+
+def test_files_named_by_yt_ripper_stay(tmp_path):
+    # yt-ripper.py turns ': ' into ' - ' and '"' into "'"
+    json_file = make_playlist(tmp_path,
+        [ { "id": "a_1", "title": 'Song: One', "playlist_index": 1 },
+          { "id": "b2", "title": 'The "Two"?', "playlist_index": 2 } ],
+        [ "01_Song - One_a_1.mp3", "02_The 'Two'_b2.mp3" ])
+    renames, problems, n_ok = rename_old_files.plan_renames([ (json_file, tmp_path) ])
+    assert renames == [ ]
+    assert problems == [ ]
+    assert n_ok == 2
+
+def test_old_names_are_renamed(tmp_path):
+    json_file = make_playlist(tmp_path,
+        [ { "id": "a_1", "title": 'Song: One', "playlist_index": 1 } ],
+        [ "Song - One_a_1.mp3" ])
+    renames, problems, n_ok = rename_old_files.plan_renames([ (json_file, tmp_path) ])
+    assert renames == [ (Path(tmp_path, "Song - One_a_1.mp3"), Path(tmp_path, "01_Song - One_a_1.mp3")) ]
@@ -5,84 +5,46 @@ import sys
 import json
 import subprocess
 import re
+import argparse
+import hashlib
+import tempfile
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import id3tools
 
-def tag_file(mp3_file, data):
-    """
-    Use id3v2 to add tags to the mp3 file.
-    """
-    # extract data from JSON
-    song   = data["title"]
-    # fallback cascade for "artist"
-    artist = ""
-    if "artist" in data:
-        artist = data["artist"]
-    elif "creator" in data:
-        artist = data["creator"]
-    elif "uploader" in data:
-        artist = data["uploader"]
-    else: sys.exit(1)
-
-    # fallback cascade for "release_year"
-    year = ""
-    if "release_year" in data:
-        year   = str(data["release_year"])
-    else:
-        year = str(data["upload_date"])[0:4]
-
-    # fallback cascade for "playlist" and "playlist_index"
-    album = ""
-    track = None
-    if "playlist" in data:
-        album  = data["playlist"]
-        track  = str(data["playlist_index"])
-    problems = 0
-    if album  == None:
-        album  = ""
-        problems = problems + 1
-    if artist == None:
-        artist = ""
-        problems = problems + 1
-    if track is None:
-        track  = [ ]
-    else:
-        track = [ "--track", track ]
-    # tag
-    cmd = [ "id3v2", "--artist", artist,
-        "--album", album,
-        "--year", year,
-        "--song", song,
-        mp3_file ]
-    if track is not None:
-        cmd[-1:-1] = track
-    res = subprocess.run(cmd)
-    if res.returncode != 0:
-        print("Error tagging {title}".format(title = song))
-        problems = problems + 1
-    return problems
+# per playlist directory, next to playlist.info.json: video ID, file name,
+# content hash and tags of every mp3 file
+MANIFEST = "manifest.json"
 
-def cleanup_title(filename):
+def tag_file(mp3_file, data, log = print):
     """
-    This function removes special character (sequences) from the title to produce a safe file name.
-    yt-dlp does the same, so we need to reproduce the same pattern.
+    Add tags to the mp3 file, in-process with id3tools. Messages go to `log`.
     """
-    clean_title = re.sub("\\?",  "",    filename)  # question marks are removed by yt-dlp
-    clean_title = re.sub("\\|+", "_",   clean_title) # pipes replaced with _ by yt-dlp
-    clean_title = re.sub(": ",  " - ", clean_title) # yt-dlp doesn't like :
-    clean_title = re.sub('"',   "'",   clean_title) # double quotes to single quotes
-    return clean_title
+    try:
+        tags, problems = id3tools.tags_from_info(data)
+    except ValueError: # no artist
+        sys.exit(1)
+    try:
+        id3tools.write_tags(mp3_file, tags)
+    except (OSError, id3tools.ID3Error) as e:
+        log("Error tagging {title}: {error}".format(title = data["title"], error = e))
+        problems = problems + 1
+    return problems
 
 def output_template(index = True):
     if index == False:
         return "%(title)s_%(id)s.%(ext)s"
     return "%(playlist_index)02d_%(title)s_%(id)s.%(ext)s"
 
-def download_from_json(json_data, audio_format = "mp3", audio_quality = "320k", output_template = output_template() ):
+def download_from_json(json_data, audio_format = "mp3", audio_quality = "320k", output_template = output_template(), capture = False):
     """
     Download one video from info in a JSON file, and convert it to mp3 format.
     The default output file name template is:
     "%(playlist_index)02d_%(title)s_%(id)s.%(ext)s" 
     This obviously only works completely if the video is embedded in a playlist
+    The JSON file gets a unique name, so several downloads can run at the same
+    time. With capture = True, the output of yt-dlp is captured instead of
+    printed. Returns the CompletedProcess; the caller checks the return code.
     """
     ytdl_cmd = [ "yt-dlp",
                 "--extract-audio",
@@ -91,22 +53,27 @@ def download_from_json(json_data, audio_format = "mp3", audio_quality = "320k",
                 "--retries", "5",
                 "--continue",
                 "--output", output_template ]
-    json_file = Path(get_file_stem(json_data) + ".info.json")
-    with open(json_file, "w") as f:
-        json.dump(json_data, f)
-    cmd_json = ytdl_cmd + [ "--load-info-json", json_file ]
-    res = subprocess.run(cmd_json)
-    if res.returncode != 0:
-        sys.exit(res.returncode)
-    # clean up, remove JSON file
-    json_file.unlink()
+    fd, json_file = tempfile.mkstemp(prefix = id3tools.get_file_stem(json_data) + ".", suffix = ".info.json", dir = ".")
+    json_file = Path(json_file)
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(json_data, f)
+        cmd_json = ytdl_cmd + [ "--load-info-json", json_file ]
+        res = subprocess.run(cmd_json, capture_output = capture, text = True)
+    finally:
+        # clean up, remove JSON file
+        json_file.unlink()
     return res
 
-def download_playlist_json(url):
+def download_playlist_json(url, flat = False):
     """
-    Download and dump playlist JSON to a single file
+    Download and dump playlist JSON to a single file. With flat = True, the
+    entries of a playlist are only listed (ID, title and URL), which is much
+    faster than extracting the full info of every video.
     """
     cmd = [ "yt-dlp", "--dump-single-json", url ]
+    if flat:
+        cmd.insert(1, "--flat-playlist")
     res = subprocess.run(cmd, capture_output = True)
     if res.returncode != 0: # exit on error
         print("Error downloading playlist JSON")
@@ -114,52 +81,206 @@ def download_playlist_json(url):
     data = json.loads(res.stdout) # read JSON on success
     return data
 
-def get_file_stem(json_data):
-    clean_title = cleanup_title(json_data["title"])
-    # if part of a playlist
-    if "playlist_index" in json_data and json_data["playlist_index"] is not None:
-        file_stem = "{index:02d}_{title}_{id}".format(index = json_data["playlist_index"], title = clean_title, id = json_data["id"])
-    # otherwise file name without index
+def fetch_entry_json(entry):
+    """
+    Full info JSON of one entry of a flat playlist, or None on error.
+    """
+    res = subprocess.run([ "yt-dlp", "--dump-single-json", entry.get("url") or entry["id"] ], capture_output = True)
+    if res.returncode != 0:
+        return None
+    return json.loads(res.stdout)
+
+def load_manifest(path):
+    """
+    Read the manifest of a playlist directory; an empty one if there is none
+    yet. entries maps video IDs to records from manifest_record().
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return { "entries": { } }
+
+def save_manifest(manifest, path):
+    # write a new file and rename it, so an interrupted run keeps the old one
+    tmp = Path(str(path) + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent = 1, sort_keys = True)
+    os.replace(tmp, path)
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def manifest_record(mp3_file, tags, record = None):
+    """
+    Manifest record of an mp3 file with the tags written to it. The content
+    hash is taken from the old `record` if size and mtime did not change,
+    so unchanged files are not read again.
+    """
+    st = mp3_file.stat()
+    if record and record["file"] == mp3_file.name and record["size"] == st.st_size and record["mtime"] == st.st_mtime_ns:
+        sha256 = record["sha256"]
     else:
-        file_stem = "{title}_{id}".format(title = clean_title, id = json_data["id"])
-    return file_stem
+        sha256 = file_hash(mp3_file)
+    return { "file": mp3_file.name, "size": st.st_size, "mtime": st.st_mtime_ns, "sha256": sha256, "tags": tags }
+
+def process_entry(entry, n, n_all, log = print, capture = False, mp3_file = None):
+    """
+    Download (unless the mp3 file exists) and tag one playlist entry. Messages
+    go to `log`. Returns the mp3 file if it needs to be revisited, else None.
+    """
+    if mp3_file is None:
+        mp3_file = Path(id3tools.get_file_stem(entry) + ".mp3")
+    if mp3_file.exists():
+        log("## mp3 file for \'{title}\' exists ({file}), skipping download".format(title = entry["title"], file = mp3_file))
+    else: # necessary file do not exist, re-create JSON, download and tag
+        log("Downloading ({n} of {n_all}): {title}".format(title = entry["title"], n = n, n_all = n_all))
+        res = download_from_json(entry, capture = capture)
+        if capture and (res.stdout or res.stderr):
+            # yt-dlp output, as it would have been printed without capture
+            log((res.stdout + res.stderr).rstrip())
+        if res.returncode != 0:
+            log("Error downloading {title} (yt-dlp exit code {code})".format(title = entry["title"], code = res.returncode))
+            log() # empty line for structure
+            return mp3_file
+    log("Tagging: {mp3}".format(mp3 = mp3_file))
+    res = tag_file(mp3_file, entry, log = log)
+    log() # empty line for structure
+    return mp3_file if res != 0 else None
+
+def process_entry_buffered(entry, n, n_all, mp3_file = None):
+    """
+    process_entry() for worker threads: messages and yt-dlp output are kept
+    and returned with the result, so they can be printed in playlist order.
+    """
+    lines = [ ]
+    problem = process_entry(entry, n, n_all, log = lambda line = "": lines.append(line), capture = True, mp3_file = mp3_file)
+    return lines, problem
 
-def download_playlist(json_data):
+def download_playlist(json_data, jobs = 1):
+    """
+    Sync a playlist into a directory named after it. `json_data` is the flat
+    playlist JSON. Entries are matched by video ID against playlist.info.json
+    and the manifest from the last run: the full info is only fetched for new
+    entries (or entries whose mp3 file is gone), and existing files are only
+    retagged if their tags changed (e.g. a new title or position) or the file
+    was changed since.
+    """
     album = json_data["title"]
     album = re.sub("[^\\w]", "_", album)
     print("# Playlist title: {album}\n".format(album = album))
 
-    # Create new directory, dump the playlist JSON, and change there
+    # Create new directory and change there
     p = Path(album)
     p.mkdir(parents = True, exist_ok = True)
-    with open(Path(p, "playlist.info.json"), "w") as json_file:
-        json.dump(json_data, json_file)
     os.chdir(p)
 
+    old_info = { }
+    if Path("playlist.info.json").exists():
+        with open("playlist.info.json") as json_file:
+            old_info = { e["id"]: e for e in json.load(json_file)["entries"] if e }
+    manifest = load_manifest(MANIFEST)
+    records = manifest["entries"]
+    flat_entries = [ e for e in json_data["entries"] if e ]
+    # files from before the manifest, and files renamed since the last run
+    # (e.g. by rename-old-files.py), are found by the ID in their name
+    listing = set(os.listdir("."))
+    missing = set(e["id"] for e in flat_entries if e["id"] not in records or records[e["id"]]["file"] not in listing)
+    found = id3tools.files_by_id(".", missing) if missing else { }
+    for video_id, mp3_file in found.items():
+        if video_id in records:
+            print("## {old} was renamed to {new}".format(old = records[video_id]["file"], new = mp3_file.name))
+            records[video_id] = dict(records[video_id], file = mp3_file.name)
+    files = { }
+    entries = [ ]
+    new = [ ]
+    for n, flat in enumerate(flat_entries, 1):
+        record = records.get(flat["id"])
+        mp3_file = Path(record["file"]) if record else found.get(flat["id"])
+        info = old_info.get(flat["id"])
+        if mp3_file is not None and mp3_file.exists():
+            files[flat["id"]] = mp3_file
+        if info is None or flat["id"] not in files:
+            new.append(n - 1)
+            entries.append(flat)
+        else:
+            # title and position may have changed since the last run
+            entries.append(dict(info, title = flat.get("title") or info["title"], playlist = json_data["title"], playlist_index = n))
+
     revisit = list()
-    playlist_length = len(json_data["entries"])
-    c = 0
-    # Download each playlist json entry individually. This is more robust and
-    # flexible than downloading the entire playlist because yt-dlp can not
-    # skip existing videos.
-    for entry in json_data["entries"]:
-        c = c + 1
-        file_stem = get_file_stem(entry)
-        json_file = Path(file_stem + ".info.json")
-        mp3_file  = Path(file_stem + ".mp3")
-        if mp3_file.exists():
-            print("## mp3 file for \'{title}\' exists ({file}), skipping download".format(title = entry["title"], file = mp3_file))
-            next
-        else: # necessary file do not exist, re-create JSON, download and tag
-            print("Downloading ({n} of {n_all}): {title}".format(title = entry["title"], n = c, n_all = playlist_length))
-            download_from_json(entry)
+    if len(new):
+        print("Downloading info for {n} new entries".format(n = len(new)))
+        with ThreadPoolExecutor(max_workers = jobs) as pool:
+            fetched = list(pool.map(lambda i: fetch_entry_json(entries[i]), new))
+        failed = set()
+        for i, data in zip(new, fetched):
+            if data is None:
+                failed.add(i)
+                print("Error downloading info for {title}".format(title = entries[i].get("title")))
+                revisit.append(entries[i].get("title"))
+                # keep the old info, if any, in playlist.info.json
+                entries[i] = old_info.get(entries[i]["id"])
+            else:
+                entries[i] = dict(data, playlist = json_data["title"], playlist_index = i + 1)
+        new = [ i for i in new if i not in failed ]
+        print()
+    with open("playlist.info.json", "w") as json_file:
+        json.dump(dict(json_data, entries = entries), json_file)
+
+    # Retag the files we already have where needed
+    playlist_length = len(entries)
+    unchanged = 0
+    skip = set(new)
+    for n, entry in enumerate(entries, 1):
+        if entry is None or n - 1 in skip or entry["id"] not in files:
+            continue
+        mp3_file = files[entry["id"]]
+        record = records.get(entry["id"])
+        try:
+            tags = id3tools.tags_from_info(entry)[0]
+        except ValueError: # no artist, tag_file() gives up
+            tags = None
+        current = manifest_record(mp3_file, tags, record)
+        if record is not None and all(current[k] == record[k] for k in ("file", "sha256", "tags")):
+            records[entry["id"]] = current
+            unchanged = unchanged + 1
+            continue
         print("Tagging: {mp3}".format(mp3 = mp3_file))
-        res = tag_file(mp3_file, entry)
-        if res != 0: revisit.append(mp3_file)
-        print() # empty line for structure
+        if tag_file(mp3_file, entry) != 0:
+            revisit.append(mp3_file)
+        else:
+            records[entry["id"]] = manifest_record(mp3_file, tags)
+    print("{n} files up to date\n".format(n = unchanged))
+    save_manifest(manifest, MANIFEST)
+
+    # Download each new playlist entry individually. This is more robust and
+    # flexible than downloading the entire playlist because yt-dlp can not
+    # skip existing videos. With several jobs, the entries are processed in a
+    # pool of worker threads, and their output is printed in playlist order.
+    work = [ (i + 1, entries[i], files.get(entries[i]["id"])) for i in new ]
+    def finish(n, entry, mp3_file, problem):
+        if problem is not None:
+            revisit.append(problem)
+            return
+        if mp3_file is None:
+            mp3_file = Path(id3tools.get_file_stem(entry) + ".mp3")
+        records[entry["id"]] = manifest_record(mp3_file, id3tools.tags_from_info(entry)[0])
+        save_manifest(manifest, MANIFEST)
+    if jobs > 1:
+        with ThreadPoolExecutor(max_workers = jobs) as pool:
+            for w, (lines, problem) in zip(work, pool.map(lambda w: process_entry_buffered(w[1], w[0], playlist_length, w[2]), work)):
+                print("\n".join(lines))
+                finish(*w, problem)
+    else:
+        for w in work:
+            finish(*w, process_entry(w[1], w[0], playlist_length, mp3_file = w[2]))
 
     if len(revisit): 
-        print("# Some files had errors while tagging, please revise:")
+        print("# Some files had errors while downloading or tagging, please revise:")
         for f in revisit:
             print("- {f}".format(f = f)) 
         
@@ -172,21 +293,23 @@ def download_playlist(json_data):
 
 def download_single_track(json_data):
     # do the same stuff, just for a single file
-    mp3_file = Path(get_file_stem(json_data) + ".mp3")
+    mp3_file = Path(id3tools.get_file_stem(json_data) + ".mp3")
     if not mp3_file.exists():
         print("Downloading {title}".format(title = json_data["title"]))
-        download_from_json(json_data, output_template = output_template(index = False))
+        res = download_from_json(json_data, output_template = output_template(index = False))
+        if res.returncode != 0:
+            sys.exit(res.returncode)
     print("Tagging: {mp3}".format(mp3 = mp3_file))
     res = tag_file(mp3_file, json_data)
 
-def main(url):
+def main(url, jobs = 1):
     # Get the playlist JSON first to get the playlist title
     print("Downloading info for {url}".format(url = url))
-    json_data = download_playlist_json(url)
+    json_data = download_playlist_json(url, flat = True)
 
     if "_type" in json_data and json_data["_type"] == "playlist":
         # is a playlist
-        download_playlist(json_data)
+        download_playlist(json_data, jobs)
     else:
         # is a single track
         download_single_track(json_data)
@@ -197,9 +320,8 @@ def main(url):
 ####### Main starts here #############################
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Error: expected exactly one URL")
-        print("Usage: {program} youtube_URL".format(program = str(sys.argv[0])))
-        sys.exit(1)
-    url = sys.argv[1]
-    main(url)
+    parser = argparse.ArgumentParser(description = "Download a YouTube video or playlist as tagged mp3 files")
+    parser.add_argument("url", help = "youtube URL")
+    parser.add_argument("-j", "--jobs", type = int, default = 1, help = "number of playlist entries to download and convert at the same time (default: 1)")
+    args = parser.parse_args()
+    main(args.url, max(1, args.jobs))